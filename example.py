@@ -1,19 +1,19 @@
-import cv2
 import os
 
+from pdxwalks.mapstore import load_map
 from pdxwalks.route import Route
-from pdxwalks.utils import convert_latlon_to_index, gpx_to_dataframe, timestamp
+from pdxwalks.utils import convert_latlon_to_index, gpx_to_dataframe, simplify_route, timestamp
 from pdxwalks.walkmap import WalkMap
 
 # define top left and bottom right coordinates (latitude, longitude)
 TOP_LEFT = (45.6065, -122.8138)
 BOT_RIGHT = (45.4535, -122.5462)
 
-# load the foreground image
-FOREGROUND_IMG = cv2.imread("./source_maps/portland_nbhd_sourcemap.png")
+# load the foreground image (decoded once and memory mapped, the animation draws on a private copy-on-write view)
+FOREGROUND_IMG = load_map("./source_maps/portland_nbhd_sourcemap.png", mode="c")
 
-# load the background image
-BACKGROUND_IMG = cv2.imread("./source_maps/portland_full_image.png")
+# load the background image (read only)
+BACKGROUND_IMG = load_map("./source_maps/portland_full_image.png", mode="r")
 
 # create the WalkMap object
 WMAP = WalkMap(FOREGROUND_IMG, TOP_LEFT, BOT_RIGHT)
@@ -21,6 +21,10 @@ WMAP = WalkMap(FOREGROUND_IMG, TOP_LEFT, BOT_RIGHT)
 # load the GPS data and convert it to indices based on the map coordinates 
 route_data = convert_latlon_to_index(gpx_to_dataframe("./example_routes/2023-01-16-153108.gpx"), TOP_LEFT, BOT_RIGHT, WMAP.shape)
 
+# drop points that fall within a pixel of the simplified path (keeping at most 30 pixels between points, so that the
+#  discovered path stays continuous), fewer points means fewer stamps and a faster render
+route_data = simplify_route(route_data, tolerance=1, max_gap=30)
+
 # select pictures to be added to the animation
 pics = [f"./example_images/{i}" for i in os.listdir("./example_images") if i.endswith(".jpeg")]
 
@@ -51,8 +55,10 @@ WMAP.snake_path_discover(routes=[route],
         distance=dist_params, 
         elev=elev_params, 
         skip_level=2, 
-        final_height=1000) 
+        final_height=1000,
+        workers=4) 
 
 
-# uncomment the line below if you wish to run FFMPEG compression automatically
-# os.system(f"ffmpeg -i {tstamp}.mp4 -vcodec libx264 -pix_fmt yuv420p -crf 30 {tstamp}_compressed.mp4")
+# add the argument below to snake_path_discover if you wish to encode the video with FFMPEG as it is rendered
+#  (falls back to OpenCV if FFMPEG is not installed)
+# ffmpeg_command="ffmpeg -i <file> -vcodec libx264 -pix_fmt yuv420p -crf 30 <out_file>"
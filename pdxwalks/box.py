@@ -20,6 +20,33 @@ class Box:
         self.top_left = Point(int(self.center.x - (self.width/2)), int(self.center.y - (self.height/2)), elev=None)
         self.bot_right = Point(int(self.center.x + (self.width/2)), int(self.center.y + (self.height/2)), elev=None)
 
+    @classmethod
+    def from_corners(cls, x_0, y_0, x_1, y_1):
+        """
+        Creates a box from the indices of its corners
+
+        Parameters
+        ----------
+        x_0: left index
+        y_0: top index
+        x_1: right index
+        y_1: bottom index
+
+        Returns
+        ----------
+        Box object
+        """
+
+        box = cls.__new__(cls)
+        box.height = y_1 - y_0
+        box.width = x_1 - x_0
+        box.asp_ratio = box.width / box.height
+        box.center = Point(int((x_0+x_1)/2), int((y_0+y_1)/2), elev=None)
+        box.top_left = Point(x_0, y_0, elev=None)
+        box.bot_right = Point(x_1, y_1, elev=None)
+
+        return box
+
     def crop_to_limits(self, shape):
         """
         Crops the box to fit within a certain shape (centers on nearest point in bigger box)
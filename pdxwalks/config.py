@@ -1,3 +1,5 @@
+import os
+
 RAD_EARTH = 6367303     # radius of earth at latitude of ~45deg
 DIST_UNITS = {"mi": 0.000621371, "km": 0.001, "m": 1}
 
@@ -8,3 +10,9 @@ COLORS = {"blue": [255,0,0],
         "green": [0,255,0],
         "white": [255,255,255],
         "black": [0,0,0]}
+
+# directory for decoded maps and other cached data
+CACHE_DIR = os.environ.get("PDXWALKS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pdxwalks"))
+
+# size limit of the route cache, least recently used entries are removed beyond it (see routecache)
+ROUTE_CACHE_BYTES = int(os.environ.get("PDXWALKS_ROUTE_CACHE_BYTES", 256*2**20))
@@ -11,9 +11,11 @@ import cv2
 import pandas as pd
 
 from pdxwalks.config import COLORS
+from pdxwalks.ingest import load_gpx_files
+from pdxwalks.mapstore import load_map
 from pdxwalks.picture import Picture
 from pdxwalks.route import Route
-from pdxwalks.utils import convert_latlon_to_index, gpx_to_dataframe, timestamp, within_x_hours
+from pdxwalks.utils import timestamp, within_x_hours
 from pdxwalks.walkmap import WalkMap
 
 
@@ -57,6 +59,7 @@ class App(tk.Frame):
         self.disp_pics = []                         # list of pictures to be displayed
 
         self.ppf = 2                    # points per frame value
+        self.route_seconds = None       # seconds per route (overrides points per frame)
         self.dwell_frames = 50          # dwell frames
         self.elev_y_span = 50           # elevation tracker Y span
         self.elev_x_buff = 0.05         # X buffer for elevation tracker
@@ -248,6 +251,13 @@ class App(tk.Frame):
         self.skip_level_entry.grid(column=2, row=row_n, columnspan=2, sticky="wens")
         row_n += 1
 
+        # selecting length of each route's animation (leave blank to use points per frame)
+        self.route_seconds_label = tk.Label(self.anim_param_frame, text="Seconds per route:", font=("Arial", 12, "bold"))
+        self.route_seconds_label.grid(column=0, row=row_n, columnspan=2, sticky="w")
+        self.route_seconds_entry = tk.Entry(self.anim_param_frame)
+        self.route_seconds_entry.grid(column=2, row=row_n, columnspan=2, sticky="wens")
+        row_n += 1
+
         # selecting number of frames to dwell on final route image
         self.dwell_frame_label = tk.Label(self.anim_param_frame, text="Dwell frames:", font=("Arial", 12, "bold"))
         self.dwell_frame_label.grid(column=0, row=row_n, columnspan=2, sticky="w")
@@ -446,7 +456,11 @@ class App(tk.Frame):
 
         # submit button
         self.submit_button = tk.Button(self.vid_param_frame, text="Submit", highlightbackground=self.button_bg, command=self._handle_submit)
-        self.submit_button.grid(column=0, row=row_n, columnspan=4, sticky="wens")
+        self.submit_button.grid(column=0, row=row_n, columnspan=2, sticky="wens")
+
+        # preview button (quick low resolution render of the same animation)
+        self.preview_button = tk.Button(self.vid_param_frame, text="Preview", highlightbackground=self.button_bg, command=lambda: self._handle_submit(preview=True))
+        self.preview_button.grid(column=2, row=row_n, columnspan=2, sticky="wens")
         row_n += 1
 
         # progress bar
@@ -484,7 +498,7 @@ class App(tk.Frame):
             if self.bg_img:
                 self.status_label["text"] = "Loading background image..."
                 self.status_label["background"] = "blue"
-                self.bg_img_obj = cv2.imread(self.bg_img)
+                self.bg_img_obj = load_map(self.bg_img, mode="r")
                 self.bg_image_label["text"] = os.path.basename(self.bg_img)
                 self.status_label["text"] = "Background image loaded"
                 self.status_label["background"] = "green"
@@ -503,7 +517,7 @@ class App(tk.Frame):
             if self.fg_img:
                 self.status_label["text"] = "Loading foreground image..."
                 self.status_label["background"] = "blue"
-                self.fg_img_obj = cv2.imread(self.fg_img)
+                self.fg_img_obj = load_map(self.fg_img, mode="c")
                 self.fg_image_label["text"] = os.path.basename(self.fg_img)
                 self.status_label["text"] = "Foreground image loaded"
                 self.status_label["background"] = "green"
@@ -578,6 +592,7 @@ class App(tk.Frame):
                 "disc_radius": self.disc_radius,
                 "mark_col": self.mark_col_str.get(),
                 "ppf": self.ppf,
+                "route_seconds": self.route_seconds_entry.get(),
                 "dwell_frames": self.dwell_frames,
                 "track_elev_cb": self.track_elev_var.get(),
                 "track_dist_cb": self.track_dist_var.get(),
@@ -623,7 +638,7 @@ class App(tk.Frame):
         # setting background image
         self.bg_img = data["bg_img"]
         if self.bg_img:
-            self.bg_img_obj = cv2.imread(self.bg_img)
+            self.bg_img_obj = load_map(self.bg_img, mode="r")
             self.bg_image_label["text"] = os.path.basename(self.bg_img)
         else:
             self.bg_img_obj = None
@@ -632,7 +647,7 @@ class App(tk.Frame):
         # setting foreground image
         self.fg_img = data["fg_img"]
         if self.fg_img:
-            self.fg_img_obj = cv2.imread(self.fg_img)
+            self.fg_img_obj = load_map(self.fg_img, mode="c")
             self.fg_image_label["text"] = os.path.basename(self.fg_img)
         else:
             self.fg_img_obj = None
@@ -664,6 +679,9 @@ class App(tk.Frame):
         self.ppf = data["ppf"]
         auto_update_entry(self.skip_level_entry, self.ppf)
 
+        # setting seconds per route (blank in older config files)
+        auto_update_entry(self.route_seconds_entry, data.get("route_seconds", ""))
+
         # setting dwell frames
         self.dwell_frames = data["dwell_frames"]
         auto_update_entry(self.dwell_frame_entry, self.dwell_frames)
@@ -754,22 +772,27 @@ class App(tk.Frame):
 
 
     # adapted from: https://stackoverflow.com/questions/71648197
-    def _handle_submit(self):
+    def _handle_submit(self, preview=False):
         """
-        Handles submit button event and calls asynchronous function
+        Handles submit and preview button events and calls asynchronous function
         """
-        threading.Thread(target=lambda loop: loop.run_until_complete(self._submit()),
+        threading.Thread(target=lambda loop: loop.run_until_complete(self._submit(preview)),
                 args=(asyncio.new_event_loop(),)).start()
-        self.submit_button["relief"] = "sunken"
-        self.submit_button["state"] = "disabled"
+        for i in (self.submit_button, self.preview_button):
+            i["relief"] = "sunken"
+            i["state"] = "disabled"
 
-        self.status_label["text"] = "Creating animation..."
+        self.status_label["text"] = "Creating preview..." if preview else "Creating animation..."
         self.status_label["background"] = "cyan"
 
 
-    async def _submit(self):
+    async def _submit(self, preview=False):
         """
         Handles submit button event
+
+        Parameters
+        ----------
+        preview: if true, renders a quick low resolution preview of the animation instead (boolean)
         """
 
         # making sure some GPX files were selected
@@ -862,6 +885,22 @@ class App(tk.Frame):
                 self.status_label["background"] = "red"
                 return
 
+        # making sure seconds per route is a positive number (blank to use points per frame)
+        if not self.route_seconds_entry.get():
+            self.route_seconds = None
+        else:
+            try:
+                self.route_seconds = float(self.route_seconds_entry.get())
+                if self.route_seconds <= 0:
+                    self.status_label["text"] = "'Seconds per route' must be a positive number"
+                    self.status_label["background"] = "red"
+                    self.route_seconds = None
+                    return
+            except ValueError:
+                self.status_label["text"] = f"'Seconds per route' should be a number, not {type(self.route_seconds_entry.get())}"
+                self.status_label["background"] = "red"
+                return
+
         # making sure dwell frames is an integer
         if not self.dwell_frame_entry.get():
             self.status_label["text"] = "Please input a value for 'Dwell frames'"
@@ -1014,8 +1053,24 @@ class App(tk.Frame):
         # creating the WalkMap object from the foreground image
         WMAP = WalkMap(self.fg_img_obj, self.top_left, self.bot_right)
 
-        # load GPX files and convert them to indices
-        latlon_indices = [convert_latlon_to_index(gpx_to_dataframe(i), self.top_left, self.bot_right, WMAP.shape) for i in self.selected_gpx_fpaths]
+        # load GPX files and convert them to indices (in parallel), files that fail to load are skipped
+        latlon_indices, gpx_errors = load_gpx_files(self.selected_gpx_fpaths, self.top_left, self.bot_right, WMAP.shape,
+                processes=os.cpu_count() or 1)
+        latlon_indices = [i for i in latlon_indices if i is not None]
+
+        for path, error in gpx_errors.items():
+            print(f"Skipped GPX file '{path}': {error}")
+
+        if not latlon_indices:
+            self.status_label["text"] = "None of the selected GPX files could be loaded"
+            self.status_label["background"] = "red"
+            self.prog_bar.stop()
+            for i in (self.submit_button, self.preview_button):
+                i["relief"] = "raised"
+                i["state"] = "normal"
+            return
+
+        skipped_note = f" ({len(gpx_errors)} GPX file(s) skipped)" if gpx_errors else ""
 
         # extract EXIF data from pictures
         pics = [Picture(i) for i in self.disp_pics]
@@ -1055,30 +1110,53 @@ class App(tk.Frame):
         else:
             elev_params = None
 
+        # frames per route for a fixed length per route, otherwise a frame every 'points per frame' points
+        route_frames = None
+        if self.route_seconds is not None:
+            route_frames = max(int(round(self.route_seconds*self.frame_rate)), 1)
+
         tstamp = timestamp()
 
+        # creating a preview of the Snake Discover video (the map itself is not drawn on or saved)
+        if preview:
+            if self.anim_type_str.get() == "Snake Discover":
+                save_path = os.path.join(self.save_folder_path_entry.get(), f"{tstamp}_snakediscover_preview.mp4")
+                WMAP.snake_path_preview(routes=routes,
+                    discover_map=self.bg_img_obj,
+                    save_path=save_path,
+                    marker_col=COLORS[self.mark_col_str.get()],
+                    skip_level=self.ppf,
+                    route_frames=route_frames,
+                    dwell_f=self.dwell_frames,
+                    fps=self.frame_rate,
+                    clear_marker=self.mark_clr_var.get(),
+                    distance=dist_params,
+                    elev=elev_params)
+
+                self.status_label["text"] = f"Saved preview '{os.path.basename(save_path)}'{skipped_note}"
+                self.status_label["background"] = "green"
+            else:
+                self.status_label["text"] = "Preview is only available for 'Snake Discover' animations"
+                self.status_label["background"] = "red"
+
         # creating the Snake Discover video
-        if self.anim_type_str.get() == "Snake Discover":
+        elif self.anim_type_str.get() == "Snake Discover":
             save_path = os.path.join(self.save_folder_path_entry.get(), f"{tstamp}_snakediscover.mp4")
             WMAP.snake_path_discover(routes=routes, 
                 discover_map=self.bg_img_obj, 
                 save_path=save_path,
                 marker_col=COLORS[self.mark_col_str.get()],
                 skip_level=self.ppf,
+                route_frames=route_frames,
                 final_height=self.final_height,
                 dwell_f=self.dwell_frames,
                 fps=self.frame_rate,
                 clear_marker=self.mark_clr_var.get(),
                 distance=dist_params,
-                elev=elev_params)
-
-            if self.ffmpeg_entry.get():
-                final_ffmpeg_command = self.ffmpeg_command
-                for k,v in {"<file>": save_path, "<out_file>": os.path.join(self.save_folder_path_entry.get(), f"{tstamp}_snakediscover_compressed.mp4")}.items():
-                    final_ffmpeg_command = final_ffmpeg_command.replace(k, v)
-                os.system(final_ffmpeg_command)
+                elev=elev_params,
+                ffmpeg_command=self.ffmpeg_entry.get() or None)
 
-            self.status_label["text"] = f"Saved animation '{os.path.basename(save_path)}'"
+            self.status_label["text"] = f"Saved animation '{os.path.basename(save_path)}'{skipped_note}"
             self.status_label["background"] = "green"
 
         # adding routes to the map without animation
@@ -1086,16 +1164,18 @@ class App(tk.Frame):
             for r in routes:
                 WMAP.draw_route_discover(r, self.bg_img_obj)
 
-            self.status_label["text"] = f"Saved map '{os.path.basename(save_path)}'"
+            self.status_label["text"] = f"Saved map '{os.path.basename(save_path)}'{skipped_note}"
             self.status_label["background"] = "green"
 
-        save_path = os.path.join(self.save_folder_path_entry.get(), f"{tstamp}_map.png")
-        cv2.imwrite(save_path, WMAP.image)
+        if not preview:
+            save_path = os.path.join(self.save_folder_path_entry.get(), f"{tstamp}_map.png")
+            cv2.imwrite(save_path, WMAP.image)
 
         self.prog_bar.stop()
 
-        self.submit_button["relief"] = "raised"
-        self.submit_button["state"] = "normal"
+        for i in (self.submit_button, self.preview_button):
+            i["relief"] = "raised"
+            i["state"] = "normal"
 
         
 
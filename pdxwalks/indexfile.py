@@ -0,0 +1,111 @@
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+from .utils import atomic_write
+
+# file layout: magic, header length (little-endian uint64), JSON header, then every column as one contiguous array.
+#  The header lists the rows, the attrs of the DataFrame and the dtype and byte offset of each column
+MAGIC = b"PDXINDEX"
+VERSION = 1
+
+# columns start at multiples of this, so memory mapped columns are aligned for any dtype
+ALIGN = 64
+
+def _aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+def save_index(index_df, path):
+    """
+    Saves an index DataFrame (as returned by convert_latlon_to_index) in a binary columnar format, which load_index
+      maps back without parsing. Numeric and datetime columns are supported
+
+    Parameters
+    ----------
+    index_df: pandas DataFrame containing index data
+    path: path to save index file to
+    """
+
+    columns = []
+    arrays = []
+    offset = 0
+
+    for name in index_df.columns:
+        series = index_df[name]
+        tz = None
+
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            tz = "UTC"
+            series = series.dt.tz_convert("UTC").dt.tz_localize(None)
+
+        array = np.ascontiguousarray(series.to_numpy())
+        if array.dtype.kind not in "biufM":
+            raise ValueError(f"Column {name} of type {array.dtype} can not be saved in an index file")
+
+        columns.append({"name": str(name), "dtype": array.dtype.str, "offset": offset, "tz": tz})
+        arrays.append(array)
+        offset = _aligned(offset + array.nbytes)
+
+    header = json.dumps({"version": VERSION, "rows": len(index_df), "columns": columns,
+        "attrs": {k: list(v) if isinstance(v, tuple) else v for k,v in index_df.attrs.items()}}).encode()
+
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    with atomic_write(path) as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for column, array in zip(columns, arrays):
+            f.seek(data_start + column["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+def load_index(path, mmap=True):
+    """
+    Loads an index file saved with save_index
+
+    Parameters
+    ----------
+    path: path to index file
+    mmap: if true, the columns are read-only views of the memory mapped file, so nothing is read until it is used,
+      otherwise the file is read into memory (default True)
+
+    Returns
+    ----------
+    pandas DataFrame in the format of convert_latlon_to_index
+    """
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an index file")
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+
+    if header["version"] > VERSION:
+        raise ValueError(f"{path} was saved by a newer version (index file version {header['version']})")
+
+    data_start = _aligned(len(MAGIC) + 8 + header_len)
+    rows = header["rows"]
+
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+
+    data = {}
+    for column in header["columns"]:
+        dtype = np.dtype(column["dtype"])
+        start = data_start + column["offset"]
+        array = buffer[start:start + rows*dtype.itemsize].view(dtype)
+
+        series = pd.Series(array, copy=False)
+        if column["tz"]:
+            series = series.dt.tz_localize(column["tz"])
+        data[column["name"]] = series
+
+    index_df = pd.DataFrame(data=data, copy=False)
+    index_df.attrs = {k: tuple(v) if isinstance(v, list) else v for k,v in header["attrs"].items()}
+
+    return index_df
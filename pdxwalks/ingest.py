@@ -0,0 +1,86 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from .config import ROUTE_CACHE_BYTES
+from .routecache import read_cached_index, route_cache_path, trim_route_cache, write_cached_index
+from .utils import convert_latlon_to_index, gpx_to_dataframe
+
+def _load_gpx(path, top_left, bot_right, img_shape, time_delta, cache_path=None):
+    """
+    Parses and projects one GPX file (runs in a worker process). Errors are returned as messages, since not every
+      parser exception survives being sent back to the main process
+    """
+
+    try:
+        index_df = convert_latlon_to_index(gpx_to_dataframe(path, time_delta=time_delta), top_left, bot_right, img_shape)
+        if cache_path is not None:
+            write_cached_index(cache_path, index_df)
+        return index_df, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def load_gpx_files(paths, top_left, bot_right, img_shape, processes=4, time_delta=-7, cache=True, cache_dir=None):
+    """
+    Parses many GPX files and converts them to indices for a given map, spread across a process pool. A file that
+      fails does not stop the others, its error is reported instead. Files that were loaded onto the same map before
+      are read from the route cache (see routecache) without being parsed
+
+    Parameters
+    ----------
+    paths: paths of the GPX files
+    top_left: lat/lon of top left corner of displayed map as 2-element array
+    bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
+    img_shape: dimension of image in format [height, width]
+    processes: number of worker processes, 1 or less loads the files in this process (default 4)
+    time_delta: difference in hours between your timezone and UTC (default -7, PST)
+    cache: whether to use the route cache (boolean, default True)
+    cache_dir: directory of the route cache (default CACHE_DIR/routes)
+
+    Returns
+    ----------
+    Tuple of the index DataFrames in the order of paths (None for files that failed) and a dictionary of path to the
+      error message of every file that failed
+    """
+
+    args = (top_left, bot_right, img_shape, time_delta)
+    loaded = [None]*len(paths)
+    cache_paths = [None]*len(paths)
+
+    if cache:
+        for n, path in enumerate(paths):
+            # unreadable files are left to the loader, which reports the error
+            try:
+                cache_paths[n] = route_cache_path(path, *args, cache_dir=cache_dir)
+            except OSError:
+                continue
+
+            index_df = read_cached_index(cache_paths[n])
+            if index_df is not None:
+                loaded[n] = (index_df, None)
+
+    todo = [n for n in range(len(paths)) if loaded[n] is None]
+
+    if (processes <= 1) or (len(todo) <= 1):
+        for n in todo:
+            loaded[n] = _load_gpx(paths[n], *args, cache_paths[n])
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(todo))) as pool:
+            futures = [pool.submit(_load_gpx, paths[n], *args, cache_paths[n]) for n in todo]
+
+            for n, future in zip(todo, futures):
+                # if a worker dies (e.g. out of memory) the files that were not finished yet are reported as failed
+                try:
+                    loaded[n] = future.result()
+                except Exception as e:
+                    loaded[n] = (None, f"{type(e).__name__}: {e}")
+
+    if cache and todo:
+        trim_route_cache(ROUTE_CACHE_BYTES, cache_dir)
+
+    results = []
+    errors = {}
+    for path, (result, error) in zip(paths, loaded):
+        results.append(result)
+        if error is not None:
+            errors[path] = error
+
+    return results, errors
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from .config import CACHE_DIR
+from .utils import atomic_write
+
+def file_hash(path, chunk_size=2**20):
+    """
+    Hashes the contents of a file
+
+    Parameters
+    ----------
+    path: path to file
+    chunk_size: number of bytes read at a time (default 1 MiB)
+
+    Returns
+    ----------
+    SHA-256 hex digest of the file (str)
+    """
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def decoded_map_path(path, cache_dir=None):
+    """
+    Path of the decoded copy of a source map in the map store (see load_map)
+
+    Parameters
+    ----------
+    path: path to source image
+    cache_dir: directory of the map store (default CACHE_DIR/maps)
+
+    Returns
+    ----------
+    Path to .npy file (str)
+    """
+
+    cache_dir = cache_dir or os.path.join(CACHE_DIR, "maps")
+    return os.path.join(cache_dir, f"{file_hash(path)}.npy")
+
+def load_map(path, mode="r", cache_dir=None):
+    """
+    Opens a source map as a memory mapped array. The image is only decoded the first time its contents are seen, the
+      raw pixels are stored as a .npy file named after the hash of the image file, so later loads (and other render
+      processes) map the same file and share its pages through the OS page cache
+
+    Parameters
+    ----------
+    path: path to source image (any format cv2.imread can read)
+    mode: memmap mode, "r" for read-only maps (e.g. the discover map), "c" (copy-on-write) for maps that get drawn on
+      (e.g. the foreground map of a WalkMap), changes are never written back to the store (default "r")
+    cache_dir: directory of the map store (default CACHE_DIR/maps)
+
+    Returns
+    ----------
+    Image matrix (np.memmap, BGR)
+    """
+
+    if mode not in ("r", "c"):
+        raise ValueError(f"Invalid mode {mode}, must be 'r' or 'c'")
+
+    npy_path = decoded_map_path(path, cache_dir)
+
+    if not os.path.exists(npy_path):
+        img = cv2.imread(path)
+        if img is None:
+            raise ValueError(f"Unable to read image {path}")
+
+        os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+        with atomic_write(npy_path) as f:
+            np.save(f, img)
+
+    return np.load(npy_path, mmap_mode=mode)
@@ -0,0 +1,70 @@
+from .utils import *
+
+class ElevProfileLayer:
+    def __init__(self, key, frame_shape, x_range, y_range, rad=1, color=[0,255,0], bg=[0,0,0]):
+        """
+        Persistent layer holding the background and the historical points of an elevation profile. Points are added
+          one at a time and the layer is composited onto each frame with one masked copy, so drawing the profile does
+          not get slower as the route goes on
+
+        Parameters
+        ----------
+        key: settings the layer was built for (compared by WalkMap.draw_elev_profile to decide whether it can be reused)
+        frame_shape: shape of the frames the layer is drawn onto
+        x_range: horizontal extent of the profile background [min, max)
+        y_range: vertical extent of the profile background [min, max)
+        rad: radius of points (default is 1 pixel)
+        color: color of points (default is green)
+        bg: background color, None for no background (default is black)
+        """
+
+        self.key = key
+        self.rad = rad
+        self.color = color
+
+        # list of points the layer has been drawn from, and how many of them have been drawn
+        self.points = None
+        self.n_points = 0
+
+        # the points can stick out of the background by their radius
+        self.x_0 = max(x_range[0] - rad, 0)
+        self.y_0 = max(y_range[0] - rad, 0)
+        self.x_1 = max(min(x_range[1] + rad, frame_shape[1]), self.x_0)
+        self.y_1 = max(min(y_range[1] + rad, frame_shape[0]), self.y_0)
+
+        self.pixels = np.zeros((self.y_1-self.y_0, self.x_1-self.x_0, 3), dtype=np.uint8)
+        self.mask = np.zeros((self.y_1-self.y_0, self.x_1-self.x_0), dtype=bool)
+
+        if bg:
+            bg_x = slice(max(x_range[0], 0) - self.x_0, max(min(x_range[1], frame_shape[1]) - self.x_0, 0))
+            bg_y = slice(max(y_range[0], 0) - self.y_0, max(min(y_range[1], frame_shape[0]) - self.y_0, 0))
+            self.pixels[bg_y, bg_x] = bg
+            self.mask[bg_y, bg_x] = True
+
+    def add_point(self, point):
+        """
+        Draws a point onto the layer
+
+        Parameters
+        ----------
+        point: [x,y] indices of the point in frame coordinates
+        """
+
+        indices = stencil_offsets("circle", self.rad) + [point[0]-self.x_0, point[1]-self.y_0]
+        in_bounds = (indices[:,0] >= 0) & (indices[:,0] < self.mask.shape[1]) & (indices[:,1] >= 0) & (indices[:,1] < self.mask.shape[0])
+        indices = indices[in_bounds]
+
+        self.pixels[indices[:,1], indices[:,0]] = self.color
+        self.mask[indices[:,1], indices[:,0]] = True
+        self.n_points += 1
+
+    def composite(self, img):
+        """
+        Copies the layer onto a frame
+
+        Parameters
+        ----------
+        img: image on which to draw
+        """
+
+        np.copyto(img[self.y_0:self.y_1, self.x_0:self.x_1], self.pixels, where=self.mask[:, :, None])
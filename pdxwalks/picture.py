@@ -12,3 +12,18 @@ class Picture:
 
         self.point = None
         self.nearest_index = None
+
+    def sprite(self, height):
+        """
+        The picture resized to a given height (aspect ratio kept). Sprites are not kept, a zoom draws each height once
+
+        Parameters
+        ----------
+        height: height of resized picture (int)
+
+        Returns
+        ----------
+        Image matrix
+        """
+
+        return cv2.resize(self.matrix, [int(height*self.asp_ratio), height], interpolation=cv2.INTER_AREA)
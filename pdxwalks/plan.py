@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+
+# kinds of plan entries
+PAN = 0         # a box of the map without overlays (zooming and panning between routes)
+POINT = 1       # the view of a route discovered up to a point, with overlays
+PICTURE = 2     # a picture zoomed in on the map
+
+KIND_NAMES = {PAN: "pan", POINT: "point", PICTURE: "picture"}
+
+# one row per entry, an entry covers 'frames' identical frames
+ENTRY_DTYPE = np.dtype([
+    ("kind", "u1"),
+    ("frames", "i4"),           # number of frames (more than 1 for holds)
+    ("route", "i4"),            # index of the route (-1 for pans)
+    ("stop", "i4"),             # points of the route discovered before the frame (index after the last one)
+    ("end", "?"),               # the route is finished, its last marker is cleared
+    ("index", "i4"),            # point shown by the overlays
+    ("distance", "f8"),         # distance traveled shown by the overlays (m, from Route.cum_distance)
+    ("pic", "i4"),              # index of the picture in route.pics (-1 if none)
+    ("pic_height", "i4"),       # height of the picture on the map (pixels)
+    ("box", "i4", (4,)),        # visible part of the map [x_0, y_0, x_1, y_1]
+    ])
+
+class FramePlan:
+    def __init__(self, entries, meta=None):
+        """
+        Choreography of a snake path discover animation: which part of the map every frame shows, how much of each
+          route is discovered, what the overlays display and where pictures are zoomed in. A plan is made in
+          milliseconds (see WalkMap.plan_snake_path), can be inspected, saved and reused, and is turned into frames by
+          WalkMap.snake_path_discover
+
+        Parameters
+        ----------
+        entries: structured array with dtype ENTRY_DTYPE
+        meta: dictionary of the settings the plan was made with (JSON serializable)
+        """
+
+        self.entries = np.asarray(entries, dtype=ENTRY_DTYPE)
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def n_frames(self):
+        """
+        Number of frames of the animation (int)
+        """
+
+        return int(self.entries["frames"].sum())
+
+    def duration(self, fps=30):
+        """
+        Length of the animation in seconds at a given frame rate
+
+        Parameters
+        ----------
+        fps: frame rate (default 30)
+
+        Returns
+        ----------
+        Duration in seconds (float)
+        """
+
+        return self.n_frames / fps
+
+    def frame_counts(self):
+        """
+        Number of frames spent on each kind of entry
+
+        Returns
+        ----------
+        Dictionary of kind name (pan, point, picture) to number of frames
+        """
+
+        return {v: int(self.entries["frames"][self.entries["kind"] == k].sum()) for k,v in KIND_NAMES.items()}
+
+    def check_routes(self, routes):
+        """
+        Raises a ValueError if the plan was not made for the given routes
+        """
+
+        lengths = [len(i) for i in routes]
+        pics = [len(i.pics) for i in routes]
+        if (self.meta.get("route_lengths", lengths) != lengths) or (self.meta.get("route_pics", pics) != pics):
+            raise ValueError("Frame plan was made for different routes")
+
+    def save(self, path):
+        """
+        Saves the plan to a .npz file
+
+        Parameters
+        ----------
+        path: path to save plan to
+        """
+
+        np.savez_compressed(path, entries=self.entries, meta=np.array(json.dumps(self.meta)))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a plan saved with FramePlan.save
+
+        Parameters
+        ----------
+        path: path to .npz file
+
+        Returns
+        ----------
+        FramePlan object
+        """
+
+        with np.load(path) as data:
+            return cls(data["entries"], json.loads(str(data["meta"])))
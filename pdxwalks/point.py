@@ -41,10 +41,10 @@ class Point:
         """
         
         if dim > 1:
-            self.all_indices = circle([self.x, self.y], dim)
+            self.all_indices = stencil_offsets("circle", dim) + [self.x, self.y]
 
         if center > 0:
-            self.center_indices = circle([self.x, self.y], center)
+            self.center_indices = stencil_offsets("circle", center) + [self.x, self.y]
         return self
 
     def add_fill(self, dim, shape="circle"):
@@ -62,10 +62,8 @@ class Point:
         """
         
         if dim > 1:
-            if shape == "circle":
-                self.all_indices = circle([self.x, self.y], dim)
-            elif shape == "square":
-                self.all_indices = square([self.x, self.y], dim)
+            if shape in ("circle", "square"):
+                self.all_indices = stencil_offsets(shape, dim) + [self.x, self.y]
             else:
                 raise ValueError("Invalid shape used in Point.add_fill")
         return self
@@ -0,0 +1,108 @@
+import cv2
+
+class MapPyramid:
+    def __init__(self, image, min_height=128):
+        """
+        Mipmap pyramid of a map. Level 0 is the map itself, every following level halves the one before it (2x2 pixel
+          averages), so a heavily zoomed out frame can be cropped from a small level instead of shrinking the full map
+
+        Parameters
+        ----------
+        image: image matrix of the map (level 0, not copied)
+        min_height: levels are added until the next one would be shorter than this (default 128 pixels)
+        """
+
+        self.levels = [image]
+
+        while self.levels[-1].shape[0]//2 >= min_height:
+            prev = self.levels[-1]
+            height = prev.shape[0]//2
+            width = prev.shape[1]//2
+            self.levels.append(self._downscale(prev[:2*height, :2*width]))
+
+        # bounding box [x_0, y_0, x_1, y_1] of the level 0 pixels that changed since the other levels were updated
+        self.dirty = None
+
+    @staticmethod
+    def _downscale(img):
+        # img has even dimensions, so every output pixel is the average of exactly one 2x2 block
+        return cv2.resize(img, [img.shape[1]//2, img.shape[0]//2], interpolation=cv2.INTER_AREA)
+
+    def level_for(self, scale):
+        """
+        Finds the smallest level that still has at least the resolution of the target
+
+        Parameters
+        ----------
+        scale: ratio of the size of a region at level 0 to the size it will be displayed at
+
+        Returns
+        ----------
+        Level number (int)
+        """
+
+        level = 0
+        while (level+1 < len(self.levels)) and (2**(level+1) <= scale):
+            level += 1
+
+        return level
+
+    def mark_dirty(self, x_0, y_0, x_1, y_1):
+        """
+        Records that the pixels [x_0, x_1) x [y_0, y_1) of level 0 changed
+
+        Parameters
+        ----------
+        x_0: left index
+        y_0: top index
+        x_1: right index (exclusive)
+        y_1: bottom index (exclusive)
+        """
+
+        if self.dirty is None:
+            self.dirty = [x_0, y_0, x_1, y_1]
+        else:
+            self.dirty = [min(self.dirty[0], x_0), min(self.dirty[1], y_0), max(self.dirty[2], x_1), max(self.dirty[3], y_1)]
+
+    def refresh(self):
+        """
+        Recomputes the parts of every level that are affected by the changed pixels
+        """
+
+        if self.dirty is None:
+            return
+
+        x_0, y_0, x_1, y_1 = self.dirty
+        self.dirty = None
+
+        for n in range(1, len(self.levels)):
+            prev = self.levels[n-1]
+            level = self.levels[n]
+
+            # region of this level that depends on the changed region of the level above
+            x_0 = max(x_0//2, 0)
+            y_0 = max(y_0//2, 0)
+            x_1 = min((x_1+1)//2, level.shape[1])
+            y_1 = min((y_1+1)//2, level.shape[0])
+            if (x_1 <= x_0) or (y_1 <= y_0):
+                return
+
+            level[y_0:y_1, x_0:x_1] = self._downscale(prev[2*y_0:2*y_1, 2*x_0:2*x_1])
+
+    def extract(self, top_left, bot_right, level):
+        """
+        Extracts a region from a level
+
+        Parameters
+        ----------
+        top_left: [x,y] indices of the top left corner at level 0
+        bot_right: [x,y] indices of the bottom right corner at level 0
+        level: level to extract from
+
+        Returns
+        ----------
+        Matrix containing the region (a view into the level)
+        """
+
+        f = 2**level
+        return self.levels[level][top_left[1]//f:bot_right[1]//f, top_left[0]//f:bot_right[0]//f]
@@ -0,0 +1,175 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .utils import atomic_write, concat_videos
+from .walkmap import WalkMap
+from .writer import SegmentWriter, open_writer
+
+def _shared_path(img):
+    """
+    Path of the .npy file behind a read-only memory mapped map (see mapstore.load_map), None if the map has to be
+      saved for the worker processes
+    """
+
+    if not (isinstance(img, np.memmap) and (img.mode == "r") and str(img.filename).endswith(".npy")):
+        return None
+
+    # slices of the map are memmaps of the same file too
+    stored = np.load(img.filename, mmap_mode="r")
+    if (stored.shape != img.shape) or (stored.offset != img.offset) or (stored.strides != img.strides):
+        return None
+
+    return img.filename
+
+def _render_segment(fg_path, discover_path, top_left, bot_right, routes, save_path, frame_range, kwargs):
+    """
+    Renders one segment of a snake path discover animation in a worker process
+    """
+
+    # the maps are shared through the page cache, the foreground map gets private copy-on-write pages since the
+    #  worker draws on it
+    fg_img = np.load(fg_path, mmap_mode="c")
+    discover_map = np.load(discover_path, mmap_mode="r")
+
+    wmap = WalkMap(fg_img, top_left, bot_right)
+    wmap.snake_path_discover(routes, discover_map, save_path, frame_range=frame_range, **kwargs)
+
+    return save_path
+
+def render_snake_path_segments(fg_img, discover_map, top_left, bot_right, routes, save_path, processes=4, segments=None, tmp_dir=None, **kwargs):
+    """
+    Renders a snake path discover animation in frame range segments across a process pool, then concatenates the
+      segment videos. Each process discovers the points before its segment in one batch, so no process replays the
+      frames of another
+
+    Parameters
+    ----------
+    fg_img: image matrix of the foreground map (the map that gets drawn on, see WalkMap)
+    discover_map: image matrix of the map that data is "discovered" from
+    top_left: lat/lon of top left corner of displayed map as 2-element array
+    bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
+    routes: routes to plot (list of Route objects)
+    save_path: path to save video to
+    processes: number of worker processes (default 4)
+    segments: number of segments to split the animation into (default: one per process)
+    tmp_dir: directory for the shared maps and segment videos (default: a temporary directory that is removed afterwards)
+    kwargs: keyword arguments passed on to WalkMap.snake_path_discover (stream and frame_range are set here)
+
+    Returns
+    ----------
+    None (saves video to save_path)
+    """
+
+    segments = segments or processes
+    kwargs = {k: v for k,v in kwargs.items() if k not in ("stream", "frame_range")}
+
+    # planned once, every worker renders its slice of the same plan
+    if kwargs.get("plan") is None:
+        plan_kws = {k: kwargs[k] for k in ("skip_level", "dwell_f", "route_frames", "sample_by") if k in kwargs}
+        kwargs["plan"] = WalkMap(fg_img, top_left, bot_right).plan_snake_path(routes, **plan_kws)
+    n_frames = kwargs["plan"].n_frames
+
+    bounds = np.linspace(0, n_frames, segments+1).astype(int)
+    frame_ranges = [(int(i), int(j)) for i,j in zip(bounds[:-1], bounds[1:]) if j > i]
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        fg_path = _shared_path(fg_img)
+        if fg_path is None:
+            fg_path = os.path.join(work_dir, "fg.npy")
+            np.save(fg_path, fg_img)
+
+        discover_path = _shared_path(discover_map)
+        if discover_path is None:
+            discover_path = os.path.join(work_dir, "discover.npy")
+            np.save(discover_path, discover_map)
+
+        ext = os.path.splitext(save_path)[1]
+        seg_paths = [os.path.join(work_dir, f"segment_{str(n).zfill(4)}{ext}") for n in range(len(frame_ranges))]
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_render_segment, fg_path, discover_path, top_left, bot_right, routes, i, j, kwargs) for i,j in zip(seg_paths, frame_ranges)]
+            for i in futures:
+                i.result()
+
+        concat_videos(seg_paths, save_path)
+
+def _render_settings_hash(wmap, routes, kwargs):
+    """
+    Hash of everything that determines the frames of a render, a checkpoint is only resumed by the same render
+    """
+
+    h = hashlib.sha256()
+    h.update(json.dumps([list(wmap.shape), list(wmap.top_left), list(wmap.bot_right), wmap.map_scale,
+        {k: v for k,v in kwargs.items() if k not in ("workers", "plan")}], sort_keys=True, default=str).encode())
+    if kwargs.get("plan") is not None:
+        h.update(kwargs["plan"].entries.tobytes())
+    for i in routes:
+        h.update(np.ascontiguousarray(i.centers).tobytes())
+        h.update(json.dumps([i.dim, i.shape, i.reveal, i.buff, i.marker_rad, [j.fpath for j in i.pics]]).encode())
+
+    return h.hexdigest()
+
+def _save_checkpoint(path, checkpoint):
+    # replaced in one step, a checkpoint is never left half written
+    with atomic_write(path, "w") as f:
+        json.dump(checkpoint, f, indent=4)
+
+def render_snake_path_resumable(wmap, routes, discover_map, save_path, segment_frames=900, work_dir=None, **kwargs):
+    """
+    Renders a snake path discover animation into segment files of segment_frames frames, writing a checkpoint after
+      each one. If the render is interrupted, calling this again with the same arguments resumes after the last
+      finished segment instead of starting over. The discovered map, camera and overlays at that point are rebuilt
+      by discovering the points before it in one batch (see the frame_range argument of snake_path_discover)
+
+    Parameters
+    ----------
+    wmap: WalkMap to draw on (must not have been drawn on yet, e.g. freshly created from the source map)
+    routes: routes to plot (list of Route objects)
+    discover_map: image representing map that data is "discovered" from
+    save_path: path to save video to
+    segment_frames: number of frames per segment, i.e. at most this many frames are lost (default 900)
+    work_dir: directory for the segments and checkpoint, removed once the video is saved (default save_path + '.parts')
+    kwargs: keyword arguments passed on to WalkMap.snake_path_discover (stream, frame_range and writer are set here)
+
+    Returns
+    ----------
+    None (saves video to save_path)
+    """
+
+    work_dir = work_dir or f"{save_path}.parts"
+    checkpoint_path = os.path.join(work_dir, "checkpoint.json")
+    kwargs = {k: v for k,v in kwargs.items() if k not in ("stream", "frame_range", "writer")}
+
+    settings = _render_settings_hash(wmap, routes, kwargs)
+    checkpoint = {"settings": settings, "frames_done": 0, "segments": []}
+
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r") as f:
+            saved = json.load(f)
+        if (saved["settings"] == settings) and all(os.path.exists(os.path.join(work_dir, i["path"])) for i in saved["segments"]):
+            checkpoint = saved
+            print(f"Resuming render at frame {checkpoint['frames_done']}")
+
+    os.makedirs(work_dir, exist_ok=True)
+
+    ext = os.path.splitext(save_path)[1]
+    def open_segment(n):
+        path = os.path.join(work_dir, f"segment_{str(n).zfill(4)}{ext}")
+        return open_writer(path, fps=kwargs.get("fps", 30), ffmpeg_command=kwargs.get("ffmpeg_command"))
+
+    def finish_segment(n, writer):
+        checkpoint["segments"].append({"path": os.path.basename(writer.path), "frames": writer.n_frames})
+        checkpoint["frames_done"] += writer.n_frames
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    writer = SegmentWriter(open_segment, segment_frames, on_segment=finish_segment, first_segment=len(checkpoint["segments"]))
+    wmap.snake_path_discover(routes, discover_map, save_path, frame_range=(checkpoint["frames_done"], None), writer=writer, **kwargs)
+
+    concat_videos([os.path.join(work_dir, i["path"]) for i in checkpoint["segments"]], save_path)
+    shutil.rmtree(work_dir)
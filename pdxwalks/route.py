@@ -1,11 +1,13 @@
+import ast
+import copy
 import datetime
 
+from .indexfile import load_index
 from .picture import Picture
-from .point import Point
 from .utils import *
 
 class Route:
-    def __init__(self, route_df, buff, dim=1, shape="circle", min_elev=0, max_elev=1200, pics=[]):
+    def __init__(self, route_df, buff, dim=1, shape="circle", min_elev=0, max_elev=1200, pics=[], marker_rad=9, reveal="points"):
         """
         Class for storing data of walk routes
 
@@ -17,12 +19,22 @@ class Route:
         shape: shape that represents single point, with dimension radius (default 'circle', valid options are 'circle' or
            'square')
         pics: list of pictures associated with a route (list of filepaths to these images)
+        marker_rad: radius of the marker drawn at the current point (default 9)
+        reveal: 'points' discovers the shape around every point, 'sweep' discovers the whole path swept by the circle
+          between consecutive points, so that fast segments leave no gaps (only for shape 'circle') (default 'points')
         """
 
+        if reveal not in ("points", "sweep"):
+            raise ValueError(f"Invalid reveal {reveal}, must be 'points' or 'sweep'")
+        if (reveal == "sweep") and (shape != "circle"):
+            raise ValueError("The 'sweep' reveal only works with shape 'circle'")
+
         self.route_df = route_df
         self.buff = buff
         self.dim = dim
-        self.shape = "circle"
+        self.shape = shape
+        self.reveal = reveal
+        self.marker_rad = marker_rad
         self.min_elev = min_elev
         self.max_elev = max_elev
         self.pics = [Picture(i) for i in pics]
@@ -33,11 +45,16 @@ class Route:
         self.x = self.route_df["x"]
         self.y = self.route_df["y"]
         self.elev = self.route_df["Elevation"]
-        self.elev_ft = [i*3.28084 for i in self.elev]
+        self.elevations = np.asarray(self.elev, dtype=float)
+        self.elev_ft = self.elevations*3.28084
 
-        self.top_left_coord = self.route_df["TopLeft"][0]
-        self.bot_right_coord = self.route_df["BotRight"][0]
-        self.img_shape = self.route_df["ImageShape"][0]
+        # map metadata is stored in the attrs of the DataFrame, older index files and CSVs repeat it on every row
+        #  instead (as text if read from a CSV)
+        meta = self.route_df.attrs if "ImageShape" in self.route_df.attrs else self.route_df.iloc[0]
+        meta = {k: ast.literal_eval(meta[k]) if isinstance(meta[k], str) else meta[k] for k in ("TopLeft", "BotRight", "ImageShape")}
+        self.top_left_coord = meta["TopLeft"]
+        self.bot_right_coord = meta["BotRight"]
+        self.img_shape = meta["ImageShape"]
 
         self.top_left = [min(self.x), min(self.y)]
         self.bot_right = [max(self.x), max(self.y)]
@@ -50,29 +67,201 @@ class Route:
 
         self.center = [int(self.zoom_top_left[0]+(self.d_x/2)), int(self.zoom_top_left[1]+(self.d_y/2))]
 
-        self.elev_scale = [(i-self.min_elev)/(self.max_elev-self.min_elev) for i in self.elev_ft]
+        self.elev_scale = (self.elev_ft-self.min_elev)/(self.max_elev-self.min_elev)
+
+        # compact representation of the route, the stamped pixels are only expanded from the shared stencils on demand
+        self.centers = np.stack([np.asarray(self.x), np.asarray(self.y)], axis=1).astype(np.int32)
+        self.cum_distance_px = np.concatenate([[0.0], np.cumsum(np.sqrt(np.sum(np.power(np.diff(self.centers, axis=0), 2.0), axis=1)))])
+
+        # distance traveled up to each point (m), along the earth's surface if the coordinates are known, otherwise
+        #  from the pixel distances (index frames saved before they kept the coordinates)
+        if ("Latitude" in self.route_df) and ("Longitude" in self.route_df):
+            self.cum_distance = cumulative_distance(self.route_df["Latitude"], self.route_df["Longitude"])
+        else:
+            self.cum_distance = self.cum_distance_px * distance_per_pixel(self.top_left_coord, self.bot_right_coord, self.img_shape)
 
+        if dim > 1:
+            self.stencil = stencil_offsets(shape, dim)
+        else:
+            self.stencil = np.zeros((1, 2), dtype=np.int32)
+        self.marker_stencil = stencil_offsets("circle", marker_rad)
 
-        if shape == "circle":
-            self.all_indices = [Point(i,j,k).add_fill_circle(dim, 9).data_dict() for i,j,k in zip(self.x, self.y, self.elev)]
+        # whether every marker pixel is also discovered by the stencil of its own point
+        stencil_set = set(map(tuple, self.stencil.tolist()))
+        self.marker_in_stencil = all(tuple(i) in stencil_set for i in self.marker_stencil.tolist())
 
         if self.pics:
             self.address_pics()
 
+    @classmethod
+    def from_index_file(cls, path, buff, **kwargs):
+        """
+        Creates a route from an index file saved with indexfile.save_index (e.g. by convert_latlon_to_index), without
+          parsing or projecting the GPX file again
+
+        Parameters
+        ----------
+        path: path to index file
+        buff: buffer around edge of zoom (number of indices)
+        kwargs: any other arguments of Route (dim, shape, pics, ...)
+
+        Returns
+        ----------
+        Route object
+        """
+
+        return cls(load_index(path), buff, **kwargs)
+
+    def __len__(self):
+        return len(self.centers)
+
+    @property
+    def all_indices(self):
+        """
+        Per-point dictionaries of stamped indices, in the format of Point.data_dict. Expanded on every access, so prefer
+          self.centers/self.stencil or stencil_indices/marker_indices
+        """
+
+        return [{"center": [int(i[0]), int(i[1])], "addl_points": self.stencil + i, "center_points": self.marker_stencil + i} for i in self.centers]
+
+    def stencil_indices(self, start, stop=None):
+        """
+        Expands the discovery stencil around one or more consecutive points
+
+        Parameters
+        ----------
+        start: index of first point
+        stop: index after the last point (default None, only expands the point at 'start')
+
+        Returns
+        ----------
+        Array of [x,y] indices (N x 2)
+        """
+
+        return self._expand(self.stencil, start, stop)
+
+    def marker_indices(self, start, stop=None):
+        """
+        Expands the marker stencil around one or more consecutive points
+
+        Parameters
+        ----------
+        start: index of first point
+        stop: index after the last point (default None, only expands the point at 'start')
+
+        Returns
+        ----------
+        Array of [x,y] indices (N x 2)
+        """
+
+        return self._expand(self.marker_stencil, start, stop)
+
+    def points_in_bounds(self, img_shape):
+        """
+        Checks which points have their whole stencil and marker inside of an image (same bounds as WalkMap.add_pixel)
+
+        Parameters
+        ----------
+        img_shape: dimension of image in format [height, width]
+
+        Returns
+        ----------
+        Boolean array with one value per point
+        """
+
+        offsets = np.concatenate([self.stencil, self.marker_stencil])
+        low = self.centers + offsets.min(axis=0)
+        high = self.centers + offsets.max(axis=0)
+
+        return (low[:,0] > 0) & (high[:,0] < img_shape[1]) & (low[:,1] > 0) & (high[:,1] < img_shape[0])
+
+    def sample_points(self, n, by="distance"):
+        """
+        Picks n points spread evenly along the route, so that the number of frames of a route does not depend on how
+          often its GPS points were recorded. The last point is always picked (and the first, if n is more than 1), a
+          point is picked more than once if there are gaps in the route
+
+        Parameters
+        ----------
+        n: number of points to pick (int)
+        by: 'distance' to space the points evenly by distance traveled, 'time' to space them evenly in time
+          (default 'distance')
+
+        Returns
+        ----------
+        Array of point indices (increasing)
+        """
+
+        if n < 1:
+            raise ValueError(f"Invalid number of points {n}, must be at least 1")
+
+        if by == "distance":
+            progress = self.cum_distance_px
+        elif by == "time":
+            progress = (self.time - self.time.iloc[0]).dt.total_seconds().to_numpy()
+            # searchsorted needs increasing values
+            progress = np.maximum.accumulate(progress)
+        else:
+            raise ValueError(f"Invalid sampling {by}, must be 'distance' or 'time'")
+
+        targets = np.linspace(progress[0], progress[-1], n)
+
+        idx = np.minimum(np.searchsorted(progress, targets), len(self)-1)
+        # rounding in linspace can leave the last target just short of progress[-1], and repeated values at the end
+        #  of progress (e.g. when stopped) would then resolve to an earlier point
+        idx[-1] = len(self)-1
+
+        return idx
+
+    def _expand(self, stencil, start, stop):
+        if stop is None:
+            stop = start + 1
+
+        return (self.centers[start:stop, None, :] + stencil[None, :, :]).reshape(-1, 2)
+
+    def scaled(self, factor):
+        """
+        Copy of the route for a map that has been resized by a factor (e.g. for previews). The pixel coordinates, zoom
+          buffer, stencil and marker radii and picture locations are all scaled, every point is kept
+
+        Parameters
+        ----------
+        factor: scale factor of the map (float, e.g. 0.25 for a map a quarter of the size)
+
+        Returns
+        ----------
+        Route object
+        """
+
+        img_shape = tuple([int(self.img_shape[0]*factor), int(self.img_shape[1]*factor)] + list(self.img_shape[2:]))
+
+        route_df = self.route_df.drop(columns=["TopLeft", "BotRight", "ImageShape"], errors="ignore")
+        route_df["x"] = (self.centers[:,0]*factor).astype(int)
+        route_df["y"] = (self.centers[:,1]*factor).astype(int)
+        route_df.attrs = index_metadata(self.top_left_coord, self.bot_right_coord, img_shape)
+
+        route = Route(route_df, int(self.buff*factor), dim=max(int(round(self.dim*factor)), 1), shape=self.shape,
+                min_elev=self.min_elev, max_elev=self.max_elev, marker_rad=max(int(round(self.marker_rad*factor)), 1),
+                reveal=self.reveal)
+
+        # pictures keep their place in the route, they are not read or addressed again
+        for i in self.pics:
+            pic = copy.copy(i)
+            if pic.point is not None:
+                pic.point = [int(pic.point[0]*factor), int(pic.point[1]*factor)]
+            route.pics.append(pic)
+
+        return route
+
     def address_pics(self):
         for i in self.pics:
-            # iterate through pictures and find nearest index
-            min_delta = 10000
+            # find nearest index to each picture
             i.point = find_index((i.lat, i.lon), self.top_left_coord, self.bot_right_coord, self.img_shape)
-            for n in range(len(self.x)):
-                delta = calculate_distance_index(i.point, [self.x[n], self.y[n]])
-                if delta < min_delta:
-                    min_delta = delta
-                    i.nearest_index = n
+            deltas = np.sqrt(np.sum(np.power(self.centers - np.asarray(i.point), 2.0), axis=1))
+            n = int(np.argmin(deltas))
+            if deltas[n] < 10000:
+                i.nearest_index = n
 
         if len(self.pics) > 0:
             self.pics = sorted(self.pics, key=lambda x: x.nearest_index)
 
- 
-
-
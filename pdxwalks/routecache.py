@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from .config import CACHE_DIR, ROUTE_CACHE_BYTES
+from .indexfile import load_index, save_index
+from .mapstore import file_hash
+
+# bumped whenever the stored arrays change, so entries written by older versions are never read
+CACHE_VERSION = 3
+
+def route_cache_dir(cache_dir=None):
+    """
+    Directory of the route cache (default CACHE_DIR/routes)
+    """
+
+    return cache_dir or os.path.join(CACHE_DIR, "routes")
+
+def route_cache_path(path, top_left, bot_right, img_shape, time_delta=-7, cache_dir=None):
+    """
+    Path of the cache entry of a GPX file projected onto a map. Entries are named after the contents of the GPX file
+      and every setting the index data depends on, so renaming or moving the file keeps its entry and editing it (or
+      projecting it onto a different map) makes a new one
+
+    Parameters
+    ----------
+    path: path to GPX file
+    top_left: lat/lon of top left corner of displayed map as 2-element array
+    bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
+    img_shape: dimension of image in format [height, width]
+    time_delta: difference in hours between your timezone and UTC (default -7, PST)
+    cache_dir: directory of the route cache (default CACHE_DIR/routes)
+
+    Returns
+    ----------
+    Path to index file (str)
+    """
+
+    key = json.dumps([CACHE_VERSION, file_hash(path), [float(i) for i in top_left], [float(i) for i in bot_right],
+        [int(i) for i in img_shape], time_delta])
+
+    return os.path.join(route_cache_dir(cache_dir), f"{hashlib.sha256(key.encode()).hexdigest()}.pdxi")
+
+def write_cached_index(cache_path, index_df):
+    """
+    Stores an index DataFrame (as returned by convert_latlon_to_index) as an index file (see indexfile.save_index).
+      Frames whose times can not be stored as datetimes are not cached
+
+    Parameters
+    ----------
+    cache_path: path of the entry (see route_cache_path)
+    index_df: pandas DataFrame containing index data
+    """
+
+    try:
+        index_df = index_df.assign(Time=pd.to_datetime(index_df["Time"]))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        save_index(index_df, cache_path)
+    except (TypeError, ValueError):
+        return
+
+def read_cached_index(cache_path):
+    """
+    Loads an index DataFrame from the route cache, and marks the entry as recently used
+
+    Parameters
+    ----------
+    cache_path: path of the entry (see route_cache_path)
+
+    Returns
+    ----------
+    pandas DataFrame in the format of convert_latlon_to_index, None if the entry does not exist
+    """
+
+    # read into memory rather than mapped, so that the entry can be evicted while the route is in use
+    try:
+        index_df = load_index(cache_path, mmap=False)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # the modification time orders entries for eviction (access times are often not updated)
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+    return index_df
+
+def _entries(cache_dir=None):
+    cache_dir = route_cache_dir(cache_dir)
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".pdxi"):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    return entries
+
+def trim_route_cache(max_bytes=ROUTE_CACHE_BYTES, cache_dir=None):
+    """
+    Removes the least recently used entries until the route cache fits in max_bytes
+
+    Parameters
+    ----------
+    max_bytes: size limit of the cache (default ROUTE_CACHE_BYTES)
+    cache_dir: directory of the route cache (default CACHE_DIR/routes)
+
+    Returns
+    ----------
+    Number of entries removed (int)
+    """
+
+    entries = sorted(_entries(cache_dir))
+    total = sum(i[1] for i in entries)
+
+    removed = 0
+    for mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    return removed
+
+def clear_route_cache(cache_dir=None):
+    """
+    Removes every entry of the route cache
+
+    Parameters
+    ----------
+    cache_dir: directory of the route cache (default CACHE_DIR/routes)
+
+    Returns
+    ----------
+    Number of entries removed (int)
+    """
+
+    return trim_route_cache(-1, cache_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the cache of parsed and projected GPX files")
+    parser.add_argument("command", choices=["clear", "trim", "info"])
+    parser.add_argument("--cache-dir", default=None, help="directory of the route cache (default CACHE_DIR/routes)")
+    parser.add_argument("--max-bytes", type=int, default=ROUTE_CACHE_BYTES, help="size limit used by 'trim'")
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        print(f"Removed {clear_route_cache(args.cache_dir)} entries from {route_cache_dir(args.cache_dir)}")
+    elif args.command == "trim":
+        print(f"Removed {trim_route_cache(args.max_bytes, args.cache_dir)} entries from {route_cache_dir(args.cache_dir)}")
+    else:
+        entries = _entries(args.cache_dir)
+        print(f"{len(entries)} entries, {sum(i[1] for i in entries)/2**20:.1f} MiB in {route_cache_dir(args.cache_dir)}")
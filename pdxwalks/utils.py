@@ -1,6 +1,13 @@
+from array import array
+import contextlib
 import datetime
-import itertools
+import functools
+import os
 import random
+import shutil
+import subprocess
+import tempfile
+import xml.etree.ElementTree as ET
 
 import cv2
 from GPSPhoto import gpsphoto
@@ -10,10 +17,39 @@ import pandas as pd
 from PIL import Image
 
 from .config import *
+from .writer import FrameWriter
 
 ### imported in evenly_space_points_to below to avoid circular imports
 # from .point import Point
 
+### imported in convert_latlon_to_index below to avoid circular imports
+# from .indexfile import save_index
+
+@contextlib.contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    Opens a file for writing under a temporary name and moves it to path once it has been written completely, so that
+      a concurrent reader never opens (or maps) a partial file
+
+    Parameters
+    ----------
+    path: path of the file
+    mode: mode to open the temporary file with (default "wb")
+
+    Returns
+    ----------
+    Context manager that yields the open file
+    """
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def timestamp():
     """
     Creates a timestamp at current moment
@@ -55,7 +91,8 @@ def haversine(l_1, l_2):
 
 def calculate_distance_coord(point_1, point_2, units="mi"):
     """
-    Calculates distance between two points
+    Calculates distance between two points (great-circle distance). Works on arrays as well, [lats, lons] pairs of
+      arrays give the distances between many pairs of points at once
 
     Parameters
     ----------
@@ -65,15 +102,59 @@ def calculate_distance_coord(point_1, point_2, units="mi"):
 
     Returns
     ----------
-    distance between the points in specified units (float)
+    distance between the points in specified units (float, or array for arrays of points)
     """
 
-    point_1 = [np.radians(i) for i in point_1]
-    point_2 = [np.radians(i) for i in point_2]
+    point_1 = np.radians(np.asarray(point_1, dtype=float))
+    point_2 = np.radians(np.asarray(point_2, dtype=float))
 
 
     return 2 * RAD_EARTH * DIST_UNITS[units] * np.arcsin(np.sqrt(haversine(point_1[0], point_2[0]) + np.cos(point_1[0]) * np.cos(point_2[0]) * haversine(point_1[1], point_2[1])))
 
+def cumulative_distance(lats, lons, units="m"):
+    """
+    Distance traveled along a path at each of its points
+
+    Parameters
+    ----------
+    lats: latitudes of the points (array)
+    lons: longitudes of the points (array)
+    units: units answer provided in (mi/km/m, default m)
+
+    Returns
+    ----------
+    Array with the distance from the first point to each point along the path (starts at 0)
+    """
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    steps = calculate_distance_coord([lats[:-1], lons[:-1]], [lats[1:], lons[1:]], units=units)
+
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+def distance_per_pixel(top_left, bot_right, img_shape, units="m"):
+    """
+    Average distance covered by a pixel of a map (mean of the horizontal and vertical distance at the top left corner)
+
+    Parameters
+    ----------
+    top_left: lat/lon of top left corner of displayed map as 2-element array
+    bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
+    img_shape: dimension of image in format [height, width]
+    units: units answer provided in (mi/km/m, default m)
+
+    Returns
+    ----------
+    Distance per pixel in specified units (float)
+    """
+
+    x_delta = (bot_right[1] - top_left[1]) / img_shape[1]
+    y_delta = (bot_right[0] - top_left[0]) / img_shape[0]
+
+    return np.mean([calculate_distance_coord(top_left, (top_left[0], top_left[1] + x_delta), units=units),
+        calculate_distance_coord(top_left, (top_left[0] + y_delta, top_left[1]), units=units)])
+
 def find_index(point, top_left, bot_right, img_shape):
     """
     Finds index of a given coordinate in an image array
@@ -163,6 +244,45 @@ def within_x_hours(time_1, time_2, hrs=3):
     else:
         return False
 
+@functools.lru_cache(maxsize=None)
+def stencil_offsets(shape, size):
+    """
+    Provides [x,y] offsets (relative to the center) of a circle or square stencil. Offsets only depend on the shape
+      and size, so they are computed once and cached; callers translate them by the center point
+
+    Parameters
+    ----------
+    shape: shape of stencil ('circle' or 'square')
+    size: radius of circle or side length of square (integer, squares should have an odd side length)
+
+    Returns
+    ----------
+    Read-only numpy array (N x 2) of offsets, ordered the same way as itertools.product over the x and y offsets
+    """
+
+    if shape == "circle":
+        side = np.arange(-size, size+1, dtype=np.int32)
+    elif shape == "square":
+        if size % 2 == 0:
+            size -= 1
+        ends = int((size-1) / 2)
+        side = np.arange(-ends, ends+1, dtype=np.int32)
+    else:
+        raise ValueError("Invalid shape used in stencil_offsets")
+
+    # all offsets in a square with side length 2*radius (x varies slowest, like itertools.product)
+    x_offsets, y_offsets = np.meshgrid(side, side, indexing="ij")
+    offsets = np.stack([x_offsets.ravel(), y_offsets.ravel()], axis=1)
+
+    # filter for offsets in square that fall within circle of given radius
+    if shape == "circle":
+        offsets = offsets[np.sqrt(np.power(offsets[:,0], 2) + np.power(offsets[:,1], 2)) < size]
+
+    # cached arrays are shared between callers, so make sure nobody modifies them
+    offsets.setflags(write=False)
+
+    return offsets
+
 def circle(center, radius):
     """
     Provides indices of circle with given radius and center
@@ -178,16 +298,7 @@ def circle(center, radius):
     """
 
     # need to convert numpy array to a list for JSON serialization
-    side = np.arange(-radius, radius+1, dtype=int).tolist()
-
-    # perform element-wise product to get combination of all 
-    #  indices in a square with side length 2*radius
-    square = list(itertools.product(side,side))
-
-    # filter for coordinates in square that fall within circle of given radius
-    coords = [[center[0]+i[0], center[1]+i[1]] for i in square if np.sqrt(pow(i[0],2)+pow(i[1],2)) < radius]
-
-    return coords
+    return (stencil_offsets("circle", radius) + [center[0], center[1]]).tolist()
 
 def square(center, side_l):
     """
@@ -210,12 +321,8 @@ def square(center, side_l):
     if side_l == 1:
         return [center]
     else:
-        ends = (side_l-1) / 2
-
         # need to convert numpy arrays to lists for JSON serialization
-        hor_indices = np.arange(int(center[0]-ends), int(center[0]+ends+1), dtype=int).tolist()
-        ver_indices = np.arange(int(center[1]-ends), int(center[1]+ends+1), dtype=int).tolist()
-        return list(itertools.product(hor_indices, ver_indices))
+        return [tuple(i) for i in (stencil_offsets("square", side_l) + [int(center[0]), int(center[1])]).tolist()]
 
 def interpolate(start, end):
     """
@@ -294,9 +401,66 @@ def evenly_spaced_points_to(from_point, to_point, quant):
 
     return [Point(int(i[0]), int(i[1]), elev=None) for i in points]
 
+def read_gpx_points(file_name):
+    """
+    Streams the track points of a GPX file into numpy arrays with iterparse, without building a document tree.
+      Namespaces are ignored, so GPX 1.0 and 1.1 files are read the same way
+
+    Parameters
+    ----------
+    file_name: path/file name of GPX file
+
+    Returns
+    ----------
+    Dictionary of arrays: Time (UTC, NaT if missing), Longitude, Latitude, Elevation (NaN if missing)
+    """
+
+    longitudes = array("d")
+    latitudes = array("d")
+    elevations = array("d")
+    times = []
+
+    # track segment being read, its points are removed from it once they have been read
+    segment = None
+
+    for event, elem in ET.iterparse(file_name, events=("start", "end")):
+        tag = elem.tag.rpartition("}")[2]
+        if event == "start":
+            if tag == "trkseg":
+                segment = elem
+            continue
+        if tag != "trkpt":
+            continue
+
+        ele = None
+        time = None
+        for child in elem:
+            tag = child.tag.rpartition("}")[2]
+            if tag == "ele":
+                ele = child.text
+            elif tag == "time":
+                time = child.text
+
+        latitudes.append(float(elem.attrib["lat"]))
+        longitudes.append(float(elem.attrib["lon"]))
+        elevations.append(float(ele) if ele and ele.strip() else np.nan)
+        times.append(time.strip() if time else None)
+
+        # finished points are detached from the tree, so memory does not grow with the number of points
+        elem.clear()
+        if segment is not None:
+            segment.remove(elem)
+
+    # ISO 8601 strings are parsed by pandas' fast path, times with other formats raise a ValueError
+    return {"Time": pd.to_datetime(pd.Series(times, dtype=object), utc=True),
+            "Longitude": np.frombuffer(longitudes, dtype=float),
+            "Latitude": np.frombuffer(latitudes, dtype=float),
+            "Elevation": np.frombuffer(elevations, dtype=float)}
+
 def gpx_to_dataframe(file_name, time_delta=-7):
     """
-    Converts a GPX file to a pandas dataframe
+    Converts a GPX file to a pandas dataframe. Files are read with the streaming reader (read_gpx_points), files it
+      cannot read are parsed with gpxpy instead
 
     Parameters
     ----------
@@ -308,6 +472,17 @@ def gpx_to_dataframe(file_name, time_delta=-7):
     pandas dataframe containing time/longitude/latitude data
     """
 
+    try:
+        data = read_gpx_points(file_name)
+    except (ET.ParseError, KeyError, ValueError):
+        return _gpxpy_to_dataframe(file_name, time_delta)
+
+    data["Time"] = data["Time"] + pd.Timedelta(hours=time_delta)
+
+    return pd.DataFrame(data=data)
+
+def _gpxpy_to_dataframe(file_name, time_delta):
+    # slower fallback for files the streaming reader rejects (gpxpy is more lenient about malformed values)
     with open(file_name) as f:
         gpx_file_data = gpxpy.parse(f)
 
@@ -425,19 +600,146 @@ def write_video(imgs, path, fps=15):
     None (saves video)
     """
 
-    height,width,layers = imgs[0].shape
-    fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
-    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    writer = FrameWriter(path, fps=fps)
+    writer.write_all(imgs)
+    writer.release()
+    cv2.destroyAllWindows()
+
+def concat_videos(paths, save_path):
+    """
+    Concatenates videos with the same frame size and codec into one video. Uses ffmpeg's concat demuxer (no
+      re-encoding) when ffmpeg is installed, otherwise decodes and re-encodes the frames with OpenCV
+
+    Parameters
+    ----------
+    paths: paths of the videos to concatenate, in order
+    save_path: path to which you want to save the video
+
+    Returns
+    ----------
+    None (saves video)
+    """
+
+    if shutil.which("ffmpeg"):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            for i in paths:
+                f.write(f"file '{os.path.abspath(i)}'\n")
 
-    for i in imgs:
-        writer.write(i)
+        try:
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", f.name, "-c", "copy", save_path], check=True)
+        finally:
+            os.remove(f.name)
 
+        return
+
+    fps = cv2.VideoCapture(paths[0]).get(cv2.CAP_PROP_FPS)
+    writer = FrameWriter(save_path, fps=fps)
+    for i in paths:
+        capture = cv2.VideoCapture(i)
+        success, frame = capture.read()
+        while success:
+            writer.write(frame)
+            success, frame = capture.read()
+        capture.release()
     writer.release()
-    cv2.destroyAllWindows()
+
+def simplify_route(index_df, tolerance=1, method="rdp", max_gap=None):
+    """
+    Drops route points that add (almost) nothing at the scale of the map, e.g. the cluster of points recorded while
+      standing at a crosswalk. Kept points keep their own timestamps and elevations
+
+    Parameters
+    ----------
+    index_df: pandas DataFrame containing route data in index form, as returned by convert_latlon_to_index
+    tolerance: pixel tolerance (default 1)
+    method: 'rdp' (Douglas-Peucker: drops points less than tolerance pixels from the simplified path) or 'dedup'
+      (keeps a point every time the route has moved another tolerance pixels along its path, 0 only drops repeated
+      pixels) (default 'rdp')
+    max_gap: largest allowed distance in pixels between consecutive points kept by 'rdp', so that the discovered path
+      stays continuous (e.g. the discovery radius of the route), None for no limit
+
+    Returns
+    ----------
+    pandas DataFrame with the kept rows (the first and last points are always kept)
+    """
+
+    xy = index_df[["x", "y"]].to_numpy(dtype=float)
+    n = len(xy)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+
+    if method == "rdp":
+        segments = [(0, n-1)]
+        while segments:
+            i, j = segments.pop()
+            if j - i < 2:
+                continue
+
+            chord = xy[j] - xy[i]
+            offsets = xy[i+1:j] - xy[i]
+            length = np.hypot(chord[0], chord[1])
+
+            # distance of the points between i and j to the chord from i to j
+            if length == 0:
+                dists = np.hypot(offsets[:,0], offsets[:,1])
+            else:
+                dists = np.abs(chord[0]*offsets[:,1] - chord[1]*offsets[:,0]) / length
+
+            k = int(np.argmax(dists))
+            if dists[k] > tolerance:
+                k = i + 1 + k
+            elif (max_gap is not None) and (length > max_gap):
+                k = (i + j)//2
+            else:
+                continue
+
+            keep[k] = True
+            segments += [(i, k), (k, j)]
+
+    elif method == "dedup":
+        steps = np.hypot(*np.diff(xy, axis=0).T)
+        if tolerance <= 0:
+            keep[1:] |= steps > 0
+        else:
+            travelled = np.floor(np.concatenate([[0.0], np.cumsum(steps)]) / tolerance)
+            keep[1:] |= np.diff(travelled) > 0
+
+    else:
+        raise ValueError(f"Invalid method {method}, must be 'rdp' or 'dedup'")
+
+    return index_df[keep].reset_index(drop=True)
+
+def find_indices(lats, lons, top_left, bot_right, img_shape):
+    """
+    Vectorized version of find_index, finds the indices of many coordinates at once
+
+    Parameters
+    ----------
+    lats: latitudes of the points (array)
+    lons: longitudes of the points (array)
+    top_left: lat/lon of top left corner of displayed map as 2-element array
+    bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
+    img_shape: dimension of image in format [height, width]
+
+    Returns
+    ----------
+    Arrays of horizontal and vertical indices
+    """
+
+    # same steps as find_index, int() truncates towards zero
+    hor_step = (bot_right[1] - top_left[1])/img_shape[1]
+    ver_step = (top_left[0] - bot_right[0])/img_shape[0]
+
+    hor_index = np.trunc((np.asarray(lons, dtype=float) - top_left[1]) / hor_step).astype(int)
+    ver_index = np.trunc((top_left[0] - np.asarray(lats, dtype=float)) / ver_step).astype(int)
+
+    return hor_index, ver_index
 
 def convert_latlon_to_index(latlon_df, top_left, bot_right, img_shape, save_path=False):
     """
-    Converts a file with latitudes and longitudes into a file with indices for a given map
+    Converts a file with latitudes and longitudes into a file with indices for a given map. The map the indices belong
+      to is stored once in the attrs of the DataFrame (TopLeft, BotRight and ImageShape), not repeated on every row
 
     Parameters
     ----------
@@ -445,37 +747,55 @@ def convert_latlon_to_index(latlon_df, top_left, bot_right, img_shape, save_path
     top_left: lat/lon of top left corner of displayed map as 2-element array
     bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
     img_shape: dimension of image in format [height, width]
-    save_path: path to save index file to
+    save_path: path to save index file to, in the binary format of indexfile.save_index (load it with
+      Route.from_index_file), or as CSV with the map metadata on every row if the path ends with .csv (load it with
+      Route(pd.read_csv(save_path, parse_dates=["Time"]), buff))
 
     Returns
     ----------
     Returns pandas DataFrame containing x and y index data
     """
-    
-    x_indices = []
-    y_indices = []
-
-    for i,j in zip(latlon_df["Latitude"], latlon_df["Longitude"]):
-        indices = find_index((i,j), top_left, bot_right, img_shape)
-        x_indices.append(indices[0])
-        y_indices.append(indices[1])
-
-    top_left_lst = [top_left for i in range(len(x_indices))]
-    bot_right_lst = [bot_right for i in range(len(x_indices))]
-    img_shape_lst = [img_shape for i in range(len(x_indices))]
-    retdf = pd.DataFrame(data={"Time": latlon_df["Time"], 
-        "x": x_indices, 
-        "y": y_indices, 
+
+    from .indexfile import save_index
+
+    x_indices, y_indices = find_indices(latlon_df["Latitude"], latlon_df["Longitude"], top_left, bot_right, img_shape)
+
+    retdf = pd.DataFrame(data={"Time": latlon_df["Time"],
+        "x": x_indices,
+        "y": y_indices,
         "Elevation": latlon_df["Elevation"],
-        "TopLeft": top_left_lst,
-        "BotRight": bot_right_lst,
-        "ImageShape": img_shape_lst})
+        "Latitude": latlon_df["Latitude"],
+        "Longitude": latlon_df["Longitude"]})
+    retdf.attrs = index_metadata(top_left, bot_right, img_shape)
 
     if save_path:
-        retdf.to_csv(save_path, index=False)
+        if str(save_path).lower().endswith(".csv"):
+            # CSV has no attrs, so the map metadata is repeated on every row as in older index files
+            retdf.assign(TopLeft=str(tuple(float(i) for i in top_left)),
+                BotRight=str(tuple(float(i) for i in bot_right)),
+                ImageShape=str(tuple(int(i) for i in img_shape))).to_csv(save_path, index=False)
+        else:
+            save_index(retdf, save_path)
 
     return retdf
 
+def index_metadata(top_left, bot_right, img_shape):
+    """
+    Metadata of an index DataFrame, the map its indices belong to
+
+    Parameters
+    ----------
+    top_left: lat/lon of top left corner of displayed map as 2-element array
+    bot_right: lat/lon of bottom right corner of displayed map as a 2-element array
+    img_shape: dimension of image in format [height, width]
+
+    Returns
+    ----------
+    Dictionary with TopLeft, BotRight and ImageShape tuples
+    """
+
+    return {"TopLeft": tuple(top_left), "BotRight": tuple(bot_right), "ImageShape": tuple(img_shape)}
+
 # below function adapted from: https://stackoverflow.com/questions/60674501/
 def draw_text(img, text, pos,
         font=cv2.FONT_HERSHEY_SIMPLEX,
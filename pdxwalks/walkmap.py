@@ -1,16 +1,20 @@
-import copy
+import functools
 import json
 import sys
 
 import cv2
 
 from .box import Box
+from .overlay import ElevProfileLayer
+from .plan import PAN, PICTURE, POINT, FramePlan
 from .point import Point
+from .pyramid import MapPyramid
 from .route import Route
 from .utils import *
+from .writer import PREVIEW_FFMPEG_COMMAND, FramePipeline, open_writer
 
 class WalkMap:
-    def __init__(self, img, top_left, bot_right):
+    def __init__(self, img, top_left, bot_right, map_scale=1):
         self.image = img
         self.top_left = top_left
         self.bot_right = bot_right
@@ -19,20 +23,30 @@ class WalkMap:
         self.asp_ratio = self.shape[1]/self.shape[0]
         self.box = Box(Point(*self.center, elev=None), self.shape[0]-10, self.asp_ratio)
 
-        # frames of final video
+        # resolution of this map relative to the full resolution map (picture zoom sizes are given for the latter)
+        self.map_scale = map_scale
+
+        # frames of final video (only used when not streaming to self.writer)
         self.vid_frames = []
+        self.writer = None
 
-        # for tracking current image
-        self.sub_box = self.box
+        # index of the next frame of the video, and the range of frames [start, stop) that actually get rendered
+        self.frame_index = 0
+        self.frame_range = None
 
-        # calculating distance per pixel
-        self.x_delta = (self.bot_right[1] - self.top_left[1]) / self.shape[1]
-        self.y_delta = (self.bot_right[0] - self.top_left[0]) / self.shape[0]
+        # discovery stamps that have not been drawn onto the image yet (see queue_points)
+        self.pending_points = []
+        self._scratch_frames = {}
+        self._frame_buffers = {}
 
-        self.dist_per_pixel_x = calculate_distance_coord(self.top_left, (self.top_left[0], self.top_left[1] + self.x_delta))
-        self.dist_per_pixel_y = calculate_distance_coord(self.top_left, (self.top_left[0] + self.y_delta, self.top_left[1]))
+        # background and historical points of the elevation profile (see draw_elev_profile)
+        self.elev_layer = None
 
-        self.dist_per_pixel_avg = np.mean([self.dist_per_pixel_x, self.dist_per_pixel_y])
+        # downscaled copies of the image for zoomed out frames, built the first time one is needed (see map_view)
+        self.pyramid = None
+
+        # for tracking current image
+        self.sub_box = self.box
 
     def add_pixel(self, x, y, color, add=True):
         """
@@ -53,9 +67,206 @@ class WalkMap:
         if (x < self.shape[1]) and (x > 0) and (y < self.shape[0]) and (y > 0):
             if add:
                 self.image[y][x] = color
+                self._mark_dirty(x, y, x+1, y+1)
             return True
         return False
 
+    def add_pixels(self, indices, src, add=True):
+        """
+        Vectorized version of add_pixel, sets many pixels at once (pixels outside of the image bounds are dropped)
+
+        Parameters
+        ----------
+        indices: array of [x,y] indices (N x 2)
+        src: color of points (length 3 iterable, BGR) or image matrix (same size as self.image) to copy pixels from
+        add: whether or not to add the points to the map (default True)
+
+        Returns
+        ----------
+        True if all pixels are within bounds, False if not
+        """
+
+        indices = np.asarray(indices, dtype=int).reshape(-1, 2)
+        x = indices[:,0]
+        y = indices[:,1]
+
+        # same bounds as add_pixel
+        in_bounds = (x < self.shape[1]) & (x > 0) & (y < self.shape[0]) & (y > 0)
+        all_in = bool(in_bounds.all())
+
+        if not all_in:
+            x = x[in_bounds]
+            y = y[in_bounds]
+
+        if add and len(x):
+            if isinstance(src, np.ndarray) and src.ndim == 3:
+                self.image[y, x] = src[y, x]
+            else:
+                self.image[y, x] = src
+            self._mark_dirty(x.min(), y.min(), x.max()+1, y.max()+1)
+
+        return all_in
+
+    def _mark_dirty(self, x_0, y_0, x_1, y_1):
+        # keeps the pyramid in step with the image, the changed region is downscaled the next time it is read
+        if self.pyramid is not None:
+            self.pyramid.mark_dirty(x_0, y_0, x_1, y_1)
+
+    def sweep_points(self, route, discover_map, start, stop, chunk=500):
+        """
+        Discovers the path swept by the route's circle while it moves from point start-1 to point stop-1. The segments
+          between consecutive points are drawn as thick lines with round ends into a mask (covering the circle stencil
+          of every point), which is applied with one masked copy per chunk, so fast segments leave no gaps
+
+        Parameters
+        ----------
+        route: route containing the points (Route object)
+        discover_map: map to fill in "discovered" areas
+        start: index of first point
+        stop: index after the last point
+        chunk: number of segments to draw at once (default 500)
+        """
+
+        # smallest line that covers the whole circle stencil (a single pixel for dim 1, like the stencil)
+        radius = route.dim if route.dim > 1 else 0
+        thickness = 2*radius if radius > 0 else 1
+
+        first = max(start-1, 0)
+        for i in range(first, max(stop-1, first+1), chunk):
+            # chunks share their end points, so the segment between two chunks is not lost
+            points = route.centers[i:min(i+chunk+1, stop)]
+            if len(points) == 1:
+                points = np.repeat(points, 2, axis=0)
+
+            # same bounds as add_pixels
+            x_0, y_0 = np.maximum(points.min(axis=0) - radius, 1)
+            x_1, y_1 = np.minimum(points.max(axis=0) + radius + 1, [self.shape[1], self.shape[0]])
+            if (x_1 <= x_0) or (y_1 <= y_0):
+                continue
+
+            mask = np.zeros((y_1-y_0, x_1-x_0), dtype=np.uint8)
+            cv2.polylines(mask, [(points - [x_0, y_0]).astype(np.int32).reshape(-1, 1, 2)], False, 255, thickness=thickness)
+            np.copyto(self.image[y_0:y_1, x_0:x_1], discover_map[y_0:y_1, x_0:x_1], where=mask.astype(bool)[:, :, None])
+            self._mark_dirty(x_0, y_0, x_1, y_1)
+
+    def stamp_point(self, route, index, discover_map, marker_col, clear_marker=True):
+        """
+        Discovers the pixels around a single point of a route and moves the marker onto it
+
+        Parameters
+        ----------
+        route: route containing the point (Route object)
+        index: index of the point in the route
+        discover_map: map to fill in "discovered" areas
+        marker_col: color of marker representing center of discover area
+        clear_marker: if true, clears the marker of the previous point (boolean)
+        """
+
+        skip = False
+
+        if route.reveal == "sweep":
+            self.sweep_points(route, discover_map, index, index+1)
+            if not self.add_pixels(route.stencil_indices(index), discover_map, add=False):
+                skip = True
+        elif not self.add_pixels(route.stencil_indices(index), discover_map):
+            skip = True
+        if not self.add_pixels(route.marker_indices(index), marker_col):
+            skip = True
+
+        # clear marker from previous point (unless part of this point fell off the map)
+        if clear_marker and (not skip):
+            if index > 0:
+                self.add_pixels(route.marker_indices(index-1), discover_map)
+
+    def discover_points(self, route, discover_map, start, stop, marker_col, clear_marker=True, chunk=500):
+        """
+        Brings the image to the state it would be in after calling stamp_point on points start..stop-1 one at a time.
+          When none of the stamps leave the map and markers get cleared, that state is the union of the discovery
+          stencils plus the newest marker, so the points are applied with one masked copy per chunk instead
+
+        Parameters
+        ----------
+        route: route containing the points (Route object)
+        discover_map: map to fill in "discovered" areas
+        start: index of first point
+        stop: index after the last point
+        marker_col: color of marker representing center of discover area
+        clear_marker: if true, the marker of each point is cleared once the next point is stamped (boolean)
+        chunk: number of points to expand at once (default 500)
+        """
+
+        if stop <= start:
+            return
+
+        if not (clear_marker and route.marker_in_stencil and route.points_in_bounds(self.shape)[start:stop].all()):
+            for a in range(start, stop):
+                self.stamp_point(route, a, discover_map, marker_col, clear_marker)
+            return
+
+        if route.reveal == "sweep":
+            self.sweep_points(route, discover_map, start, stop, chunk=chunk)
+        else:
+            for i in range(start, stop, chunk):
+                indices = route.stencil_indices(i, min(i+chunk, stop))
+                x_0, y_0 = indices.min(axis=0)
+                x_1, y_1 = indices.max(axis=0) + 1
+
+                mask = np.zeros((y_1-y_0, x_1-x_0), dtype=bool)
+                mask[indices[:,1]-y_0, indices[:,0]-x_0] = True
+                np.copyto(self.image[y_0:y_1, x_0:x_1], discover_map[y_0:y_1, x_0:x_1], where=mask[:, :, None])
+                self._mark_dirty(x_0, y_0, x_1, y_1)
+
+        # the marker of the point before start is cleared when start is stamped
+        if start > 0:
+            self.add_pixels(route.marker_indices(start-1), discover_map)
+
+        # every other marker is covered by the stencil of its own point, except the newest one, which is drawn before
+        #  the marker of the point before it gets cleared
+        self.add_pixels(route.marker_indices(stop-1), marker_col)
+        if stop > 1:
+            self.add_pixels(route.marker_indices(stop-2), discover_map)
+
+    def queue_points(self, route, stop, discover_map, marker_col, clear_marker=True, end_of_route=False):
+        """
+        Queues the points of a route up to (not including) stop for discovery. The points are only drawn onto the image
+          by sync_map, right before a frame needs them, so that consecutive points are discovered in one batch and points
+          before a frame range are never drawn one at a time
+
+        Parameters
+        ----------
+        route: route containing the points (Route object)
+        stop: index after the last point to discover
+        discover_map: map to fill in "discovered" areas
+        marker_col: color of marker representing center of discover area
+        clear_marker: if true, clears the marker of each point once the next point is stamped (boolean)
+        end_of_route: if true, the route is finished and its last marker gets cleared as well (boolean)
+        """
+
+        if self.pending_points and (self.pending_points[-1]["route"] is route):
+            self.pending_points[-1]["stop"] = stop
+            self.pending_points[-1]["end_of_route"] = end_of_route
+        else:
+            self.pending_points.append({"route": route, "start": 0, "stop": stop, "discover_map": discover_map,
+                "marker_col": marker_col, "clear_marker": clear_marker, "end_of_route": end_of_route})
+
+    def sync_map(self):
+        """
+        Draws every queued point (see queue_points) onto the image
+        """
+
+        for i in self.pending_points:
+            self.discover_points(i["route"], i["discover_map"], i["start"], i["stop"], i["marker_col"], i["clear_marker"])
+            if i["end_of_route"] and i["clear_marker"]:
+                self.add_pixels(i["route"].marker_indices(i["stop"]-1), i["discover_map"])
+
+        # keep track of where an unfinished route left off
+        if self.pending_points and not self.pending_points[-1]["end_of_route"]:
+            last = self.pending_points[-1]
+            last["start"] = last["stop"]
+            self.pending_points = [last]
+        else:
+            self.pending_points = []
+
     def draw_nbhd(self, nbhd_df, size=1, color=[0,0,255]):
         """
         Draws neighborhood outline onto image
@@ -104,12 +315,228 @@ class WalkMap:
         ----------
         self (updates self.image)
         """
-        for i in route.all_indices:
-            for j in i["addl_points"]:
-                self.image[j[1]][j[0]] = discover_map[j[1]][j[0]]
+        if route.reveal == "sweep":
+            self.sweep_points(route, discover_map, 0, len(route))
+            return self
+
+        # expand the stencils in chunks so the full set of stamped indices is never held at once
+        for i in range(0, len(route), 500):
+            self.add_pixels(route.stencil_indices(i, i+500), discover_map)
 
         return self
-         
+
+    def frames_in_range(self, n=1):
+        """
+        Checks whether any of the next n frames fall within self.frame_range
+
+        Parameters
+        ----------
+        n: number of frames (default 1)
+
+        Returns
+        ----------
+        True if at least one of the frames gets rendered, False if not
+        """
+
+        if self.frame_range is None:
+            return n > 0
+
+        start, stop = self.frame_range
+        return (self.frame_index + n > start) and ((stop is None) or (self.frame_index < stop))
+
+    def frames_done(self):
+        """
+        Checks whether every frame of self.frame_range has been produced
+        """
+
+        return (self.frame_range is not None) and (self.frame_range[1] is not None) and (self.frame_index >= self.frame_range[1])
+
+    def skip_frames(self, n):
+        """
+        Counts n frames towards the video without rendering them
+
+        Parameters
+        ----------
+        n: number of frames
+        """
+
+        self.frame_index += n
+
+    def scratch_frame(self, size):
+        """
+        Returns a reusable blank frame of the given size [width,height], used to keep the overlays up to date for frames
+          outside of the frame range
+        """
+
+        if tuple(size) not in self._scratch_frames:
+            self._scratch_frames[tuple(size)] = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+
+        return self._scratch_frames[tuple(size)]
+
+    def frame_buffer(self, size):
+        """
+        Returns the next buffer of a ring of preallocated frames of the given size [width,height], frames are resized
+          straight into these instead of allocating a new array every frame. The ring is one longer than the number of
+          frames the writer may still hold on to, so a buffer is never reused before the writer is done with it
+
+        Returns
+        ----------
+        Image matrix, or None when the frames are kept in self.vid_frames (every frame needs its own array)
+        """
+
+        if self.writer is None:
+            return None
+
+        n = self.writer.max_pending + 1
+        key = tuple(size)
+        if (key not in self._frame_buffers) or (len(self._frame_buffers[key][0]) != n):
+            self._frame_buffers[key] = [[np.empty((size[1], size[0], 3), dtype=np.uint8) for i in range(n)], 0]
+
+        buffers, index = self._frame_buffers[key]
+        self._frame_buffers[key][1] = (index + 1) % n
+
+        return buffers[index]
+
+    def add_frames(self, frames):
+        """
+        Adds frames to the video, either streaming them to the open writer or collecting them in self.vid_frames.
+          Frames outside of self.frame_range are counted but dropped
+
+        Parameters
+        ----------
+        frames: iterable of image matrices (can be a generator)
+        """
+
+        for i in frames:
+            if self.frames_in_range():
+                if self.writer is not None:
+                    self.writer.write(i)
+                else:
+                    self.vid_frames.append(i)
+            self.frame_index += 1
+
+    def add_held(self, frame, n):
+        """
+        Adds the same frame n times in a row. The frame is handed to the writer once and then held, so long dwells cost
+          neither memory nor resizing
+
+        Parameters
+        ----------
+        frame: image matrix
+        n: number of frames
+        """
+
+        # number of frames that fall within the frame range
+        start, stop = self.frame_range or (0, None)
+        first = max(self.frame_index, start)
+        last = self.frame_index + n if stop is None else min(self.frame_index + n, stop)
+        n_rendered = max(0, int(last - first))
+
+        if n_rendered > 0:
+            if self.writer is not None:
+                self.writer.write(frame)
+                self.writer.hold(n_rendered-1)
+            else:
+                self.vid_frames += [frame] * n_rendered
+
+        self.frame_index += n
+
+    def add_resized(self, src, final_height, finish=None, snapshot=True):
+        """
+        Resizes a view of the map to a frame of the given height and adds it to the video. The frame is resized straight
+          from the view into a reused frame buffer (see frame_buffer)
+
+        Parameters
+        ----------
+        src: image matrix to resize (typically a view of the map, see add_view)
+        final_height: height of the frame (width calculated from aspect ratio)
+        finish: optional function called with the resized frame before it is added (e.g. to draw overlays)
+        snapshot: resize src right away because it is about to change. When rendering through a FramePipeline, pass
+          False if src does not change until flush_frames is called, so that the resize happens on a worker thread
+          (boolean, default True)
+        """
+
+        size = [int(final_height*self.asp_ratio), final_height]
+
+        if not self.frames_in_range():
+            # the overlays are still drawn, they carry state from frame to frame
+            if finish is not None:
+                finish(self.scratch_frame(size))
+            self.skip_frames(1)
+            return
+
+        self.sync_map()
+
+        frame = self.frame_buffer(size)
+
+        if (self.writer is not None) and self.writer.asynchronous:
+            if snapshot:
+                # resizing is cheaper than copying the view for a worker thread, overlays are still drawn and the
+                #  frame encoded on the writer thread
+                frame = cv2.resize(src, size, dst=frame, interpolation=cv2.INTER_AREA)
+                self.writer.write(frame, finish=finish)
+            else:
+                self.writer.submit(cv2.resize, src, size, dst=frame, interpolation=cv2.INTER_AREA, finish=finish)
+            self.frame_index += 1
+        else:
+            frame = cv2.resize(src, size, dst=frame, interpolation=cv2.INTER_AREA)
+            if finish is not None:
+                finish(frame)
+            self.add_frames([frame])
+
+    def add_view(self, box, final_height, finish=None, snapshot=True):
+        """
+        Adds a frame showing a box of the map (see add_resized and map_view)
+
+        Parameters
+        ----------
+        box: region of the map to show (Box object)
+        final_height: height of the frame (width calculated from aspect ratio)
+        finish: optional function called with the resized frame before it is added (e.g. to draw overlays)
+        snapshot: copy the view before handing it to a worker thread (see add_resized)
+        """
+
+        src = None
+        if self.frames_in_range():
+            self.sync_map()
+            src = self.map_view(box, final_height)
+
+        self.add_resized(src, final_height, finish=finish, snapshot=snapshot)
+
+    def map_view(self, box, final_height):
+        """
+        View of a box of the map to be resized to a frame of the given height. Zoomed out boxes are taken from the
+          smallest pyramid level that still has at least the resolution of the frame, so the whole map is not shrunk
+          again on every frame
+
+        Parameters
+        ----------
+        box: region of the map (Box object)
+        final_height: height of the frame the view will be resized to
+
+        Returns
+        ----------
+        Matrix containing the region (a view into self.image or a pyramid level)
+        """
+
+        scale = (box.bot_right.y - box.top_left.y) / final_height
+        if scale < 2:
+            return box.extract_box(self.image)
+
+        if self.pyramid is None:
+            self.pyramid = MapPyramid(self.image)
+        self.pyramid.refresh()
+
+        level = self.pyramid.level_for(scale)
+        return self.pyramid.extract([box.top_left.x, box.top_left.y], [box.bot_right.x, box.bot_right.y], level)
+
+    def flush_frames(self):
+        """
+        Waits until every frame handed to the writer has been rendered and written
+        """
+
+        if self.writer is not None:
+            self.writer.flush()
 
     def draw_streets(self, fname, color=[255,0,255]):
         """
@@ -168,11 +595,12 @@ class WalkMap:
         Parameters
         ----------
         img: image on which to draw
-        dist: current distance
-        unit: unit of measurement for distance
+        dist: current distance (m)
+        unit: unit of measurement for distance (mi/km/m)
         x_buff: horizontal buffer from left of screen (final distance in pixels from left of image is the width of image * x_buff)
         y_buff: vertical buffer from bottom of screen (final distance in pixels from top of image is the height of image * y_buff)
         """
+        dist = dist * DIST_UNITS[unit]
         draw_text(img, f"{'%.3f'%round(dist,3)} {unit}", (int(img.shape[1]*x_buff), int(img.shape[0]*y_buff)))
 
     def draw_elev_profile(self, img, index, elev_indices, route, y_span=50, x_buff=0.05, y_buff=0.9, rad=1, color=[0,255,0], bg=[0,0,0], text=True):
@@ -213,18 +641,19 @@ class WalkMap:
 
         elev_indices.append([x_index, y_index])
 
-        if bg:
-            for x in range(x_ind_min, x_ind_max):
-                for y in range(y_ind_min, y_ind_max):
-                    try:
-                        img[y][x] = bg
-                    except:
-                        continue
-        
-        for i in elev_indices:
-            c = circle([i[0], i[1]], rad)
-            for j in c:
-                img[j[1]][j[0]] = color
+        # the background and the historical points live on a persistent layer that only needs the newest point added,
+        #  it is rebuilt whenever a different route, frame size, setting or list of indices comes in
+        key = (route, img.shape, y_span, x_buff, y_buff, rad, tuple(color), tuple(bg) if bg else None)
+        layer = self.elev_layer
+        if (layer is None) or (layer.key != key) or (layer.points is not elev_indices) or (layer.n_points > len(elev_indices)):
+            layer = ElevProfileLayer(key, img.shape, [x_ind_min, x_ind_max], [y_ind_min, y_ind_max], rad=rad, color=color, bg=bg)
+            layer.points = elev_indices
+            self.elev_layer = layer
+
+        for i in elev_indices[layer.n_points:]:
+            layer.add_point(i)
+
+        layer.composite(img)
 
         if text:
             draw_text(img, f"{round(curr_elev,1)}'", (x_index, y_index),
@@ -283,6 +712,33 @@ class WalkMap:
         # adding text to image
         draw_text(img, f"{round(route.elev_ft[index],1)}'", (elev_bar_x_offset+elev_track_width+10, int((elev_bar_height*(1-route.elev_scale[index]))+elev_bar_top_left[1]-(elev_track_height/2))), font=cv2.FONT_HERSHEY_PLAIN)
 
+    def draw_overlays(self, img, index, route, tot_distance, elev_indices, distance=None, elev=None):
+        """
+        Draws the distance and elevation trackers onto a frame
+
+        Parameters
+        ----------
+        img: image on which to draw
+        index: index of current point
+        route: route object representing route being plotted
+        tot_distance: distance travelled so far (m)
+        elev_indices: list of previous elevation indices (see draw_elev_profile)
+        distance: if not None, kw arguments of draw_distance_text as dictionary
+        elev: if not None, dictionary with the type of elevation tracker ('bar' or 'prof') and its kw arguments
+
+        Returns
+        ----------
+        None (draws on passed image)
+        """
+
+        if distance:
+            self.draw_distance_text(img, tot_distance, **distance)
+        if elev:
+            if elev["type"] == "bar":
+                self.draw_elev_bar(img, index, route, **elev["kws"])
+            elif elev["type"] == "prof":
+                self.draw_elev_profile(img, index, elev_indices, route, **elev["kws"])
+
     def zoom_and_pan(self, start, end, steps, final_height):
         """
         Creates zoom and pan pattern in matrix
@@ -298,79 +754,164 @@ class WalkMap:
         Array of matrices representing slices of image zoomed/panned
         """
 
+        return list(self.iter_zoom_and_pan(start, end, steps, final_height))
+
+    def iter_zoom_and_pan(self, start, end, steps, final_height):
+        """
+        Generator version of zoom_and_pan, yields one resized frame at a time so that the frames can be streamed
+
+        Parameters
+        ----------
+        start: starting point (as Box object)
+        end: ending point (as Box object)
+        steps: number of steps in which to zoom and pan (int)
+
+        Returns
+        ----------
+        Generator of matrices representing slices of image zoomed/panned
+        """
+
+        final_width = int(self.asp_ratio * final_height)
+
+        for box in self._zoom_and_pan_boxes(start, end, steps):
+            yield cv2.resize(self.map_view(box, final_height), [final_width, final_height], interpolation=cv2.INTER_AREA)
+
+    def _zoom_and_pan_boxes(self, start, end, steps):
+        """
+        Generator of the boxes of a zoom and pan pattern, the current box is tracked in self.sub_box
+        """
+
         # define where the centers of your squares will go
         center_pattern = evenly_spaced_points_to(start.center, end.center, steps)
 
         delta = (end.height-start.height)/(steps-1)
         sizes = [int(i) for i in np.arange(start.height, end.height+delta, delta)]
 
-        images = []
-        final_width = int(self.asp_ratio * final_height)
-
         for i,j in zip(center_pattern, sizes):
             # create a box for each point
             self.sub_box = Box(i, j, self.asp_ratio)
             self.sub_box.crop_to_limits(list(reversed(list(self.shape[:2]))))
-            images.append(self.sub_box.extract_box(self.image))
-
-        resized_imgs = []
-
-        for n, i in enumerate(images):
-            resized_imgs.append(cv2.resize(i, [final_width, final_height], interpolation=cv2.INTER_AREA))
+            yield self.sub_box
 
-        return resized_imgs
-
-    def add_pic_zoom(self, pic, bg_img, h_0, save_h, step=100, h_f="height", dwell_f=50):
+    def pic_zoom_heights(self, pic, h_0, step=100, h_f="height"):
         """
-        Adds a picture by zooming it in on map
+        Heights of the picture on each frame of a picture zoom, the zoom is cut off early if the picture would hit the
+          boundary of the map
 
         Parameters
         ----------
         pic: picture to add (Picture object)
-        bg_img: background image (numpy matrix)
         h_0: initial height of image
-        save_h: height of saved image
         step: number of pixels to increase height by on each frame
         h_f: final height of image (default 'height' for height of map)
-        dwell_f: number of frames to dwell on the expanded image (default 50)
+
+        h_0, step and h_f are pixels of the full resolution map, on a scaled map (see scaled) the heights are scaled so
+          that the zoom has the same number of frames
 
         Returns
         ----------
-        None (adds frames to self.vid_frames)
+        List of heights (int)
         """
 
-        # TODO: add error handling for pictures that may display outside the bounding box
-        forward_imgs = []
-
         if h_f == "height":
-            h_f = self.shape[0]
+            h_f = int(self.shape[0]/self.map_scale)
 
+        heights = []
         for h in range(h_0, h_f, step):
+            h = max(int(h*self.map_scale), 1)
             w = int(h * pic.asp_ratio)
-            resized_pic = cv2.resize(copy.deepcopy(pic.matrix), [w, h], interpolation=cv2.INTER_AREA)
             top_left = [int(pic.point[0]-w/2), int(pic.point[1]-h/2)]
             bot_right = [int(pic.point[0]+w/2), int(pic.point[1]+h/2)]
 
-            # if the picture zoom ends up hitting the boundary of the background image, cut it off early
-            try:
-                bg_img[top_left[1]:bot_right[1], top_left[0]:bot_right[0]] = resized_pic
-            except IndexError as e:
-                print(e)
+            if (top_left[0] < 0) or (top_left[1] < 0) or (bot_right[0] > self.shape[1]) or (bot_right[1] > self.shape[0]):
                 print(f"Stopping picture zoom at height {h}!")
                 break
 
-            save_img = cv2.resize(self.sub_box.extract_box(bg_img), [int(save_h*self.asp_ratio), save_h], interpolation=cv2.INTER_AREA)
+            heights.append(h)
+
+        return heights
+
+    def add_pic_zoom(self, pic, bg_img, h_0, save_h, step=100, h_f="height", dwell_f=50):
+        """
+        Adds a picture by zooming it in on map
+
+        Parameters
+        ----------
+        pic: picture to add (Picture object)
+        bg_img: background image (numpy matrix, not modified), None to use self.image
+        h_0: initial height of image
+        save_h: height of saved image
+        step: number of pixels to increase height by on each frame
+        h_f: final height of image (default 'height' for height of map)
+        dwell_f: number of frames to dwell on the expanded image (default 50)
+
+        Returns
+        ----------
+        None (adds frames to the video through self.add_frames)
+        """
+
+        heights = self.pic_zoom_heights(pic, h_0, step=step, h_f=h_f)
+        if not heights:
+            return
+
+        if not self.frames_in_range(2*len(heights) + dwell_f):
+            self.skip_frames(2*len(heights) + dwell_f)
+            return
 
-            forward_imgs.append(save_img)
+        if bg_img is None:
+            self.sync_map()
+            bg_img = self.image
+
+        forward_imgs = self.pic_frames(pic, bg_img, heights, save_h)
         
         # expanding frames
-        self.vid_frames += forward_imgs
+        self.add_frames(forward_imgs)
 
         # dwell on final expanded frame for given number of frames
-        self.vid_frames += [forward_imgs[-1]]*dwell_f
+        self.add_held(forward_imgs[-1], dwell_f)
 
         # reverse expand frames
-        self.vid_frames += forward_imgs[::-1]
+        self.add_frames(forward_imgs[::-1])
+
+    def pic_frames(self, pic, bg_img, heights, save_h):
+        """
+        Frames of a picture zooming in on the visible part of the map (self.sub_box)
+
+        Parameters
+        ----------
+        pic: picture to add (Picture object)
+        bg_img: background image (numpy matrix, not modified)
+        heights: heights of the picture, in increasing order (see pic_zoom_heights)
+        save_h: height of saved image
+
+        Returns
+        ----------
+        List of frames, one per height
+        """
+
+        frames = []
+
+        # only the visible part of the map is copied, the picture is drawn into that copy
+        box = self.sub_box
+        view = box.extract_box(bg_img).copy()
+
+        for h in heights:
+            w = int(h * pic.asp_ratio)
+            top_left = [int(pic.point[0]-w/2), int(pic.point[1]-h/2)]
+
+            # part of the picture that falls within the box, in map indices
+            x_0 = max(top_left[0], box.top_left.x)
+            y_0 = max(top_left[1], box.top_left.y)
+            x_1 = min(top_left[0]+w, box.bot_right.x)
+            y_1 = min(top_left[1]+h, box.bot_right.y)
+
+            if (x_1 > x_0) and (y_1 > y_0):
+                view[y_0-box.top_left.y:y_1-box.top_left.y, x_0-box.top_left.x:x_1-box.top_left.x] = \
+                        pic.sprite(h)[y_0-top_left[1]:y_1-top_left[1], x_0-top_left[0]:x_1-top_left[0]]
+
+            frames.append(cv2.resize(view, [int(save_h*self.asp_ratio), save_h], interpolation=cv2.INTER_AREA))
+
+        return frames
             
     def snake_path_discover(self, 
             routes, 
@@ -383,7 +924,15 @@ class WalkMap:
             fps=30,
             clear_marker=True,
             distance=None,
-            elev=None):
+            elev=None,
+            stream=True,
+            workers=0,
+            frame_range=None,
+            ffmpeg_command=None,
+            writer=None,
+            plan=None,
+            route_frames=None,
+            sample_by="distance"):
         """
         Creates a snake path that "discovers" (i.e., borrows pixels from) another map.
           Essentially simulates discovering new areas in a video game map
@@ -400,114 +949,292 @@ class WalkMap:
         clear_marker: if true, will clear marker after frame is captured (boolean)
         distance: if not None, will track and display distance traveled, can pass kw arguments as dictionary
         elev: if not None, will track and display elevation on a sliding scale, can pass kw arguments as dictionary
+        stream: if true, frames are written to save_path as soon as they are produced so that memory use stays bounded
+          by a few frames; if false, frames are collected in self.vid_frames and written at the end (boolean)
+        workers: number of threads resizing frames while the map is being drawn on, 0 renders everything on the
+          calling thread (only used when streaming, default 0)
+        frame_range: if not None, only frames [start, stop) of the animation are rendered and saved (stop can be None
+          for the end of the animation). Points before the range are discovered in one batch rather than frame by
+          frame, so segments of one animation can be rendered independently and concatenated (see
+          render_snake_path_segments)
+        ffmpeg_command: if not None, frames are piped into ffmpeg with the settings of this command template (see
+          writer.FFmpegWriter) instead of being encoded by OpenCV, falls back to OpenCV if ffmpeg is not installed (only
+          used when streaming)
+        writer: if not None, frames are streamed into this writer (e.g. a writer.SegmentWriter) instead of a new one
+          for save_path, it is released once the animation is done
+        plan: frame plan for these routes (FramePlan, see plan_snake_path), made from skip_level, dwell_f,
+          route_frames and sample_by if None
+        route_frames: if not None, number of frames in which each route is discovered, instead of a frame every
+          skip_level points (int or list with one int per route, e.g. int(seconds*fps) for a target duration)
+        sample_by: how frames are spread along a route when route_frames is given, 'distance' or 'time' (default
+          'distance')
+
+        Returns
+        ----------
+        None (saves video to save_path)
+        """
+
+        self.frame_index = 0
+        self.frame_range = frame_range
+
+        if writer is not None:
+            self.writer = writer
+        elif stream:
+            self.writer = open_writer(save_path, fps=fps, ffmpeg_command=ffmpeg_command)
+
+        if (self.writer is not None) and (workers > 0):
+            self.writer = FramePipeline(self.writer, workers=workers)
+
+        try:
+            if plan is None:
+                plan = self.plan_snake_path(routes, skip_level=skip_level, dwell_f=dwell_f, route_frames=route_frames, sample_by=sample_by)
+            self._execute_plan(plan, routes, discover_map, marker_col, final_height, clear_marker, distance, elev)
+
+            # leave the image with every route discovered (unless the frame range stopped the animation early)
+            if not self.frames_done():
+                self.sync_map()
+        finally:
+            if self.writer is not None:
+                self.writer.release()
+                self.writer = None
+            self.frame_range = None
+
+        if (writer is None) and (not stream):
+            write_video(self.vid_frames, save_path, fps=fps)
+
+    def scaled(self, factor):
+        """
+        Copy of the map resized by a factor, e.g. for previews (see snake_path_preview)
+
+        Parameters
+        ----------
+        factor: scale factor (float, e.g. 0.25 for a map a quarter of the size)
+
+        Returns
+        ----------
+        WalkMap object
+        """
+
+        self.sync_map()
+        img = cv2.resize(self.image, [int(self.shape[1]*factor), int(self.shape[0]*factor)], interpolation=cv2.INTER_AREA)
+
+        return WalkMap(img, self.top_left, self.bot_right, map_scale=self.map_scale*factor)
+
+    def snake_path_preview(self, routes, discover_map, save_path, factor=0.25, final_height=240, ffmpeg_command=PREVIEW_FFMPEG_COMMAND, **kwargs):
+        """
+        Renders a draft of snake_path_discover on a downscaled copy of the maps. The zooms, pictures and overlays play
+          out the same way as in the full render, but every frame is drawn at a fraction of the resolution and encoded
+          with the fastest codec settings. This map is not drawn on
+
+        Parameters
+        ----------
+        routes: routes to plot (list of Route objects, for this map)
+        discover_map: image representing map that data is "discovered" from (should be same size as self.image)
+        save_path: path to save video to
+        factor: scale factor of the maps and routes (default 0.25)
+        final_height: height of preview video (default 240)
+        ffmpeg_command: encoder settings (see snake_path_discover), default PREVIEW_FFMPEG_COMMAND
+        kwargs: keyword arguments passed on to snake_path_discover
 
         Returns
         ----------
-        List of matrices representing frames to be made into a video/gif
+        The downscaled WalkMap (with every route discovered)
+        """
+
+        preview = self.scaled(factor)
+        preview_discover = cv2.resize(discover_map, [preview.shape[1], preview.shape[0]], interpolation=cv2.INTER_AREA)
+
+        preview.snake_path_discover([i.scaled(factor) for i in routes], preview_discover, save_path,
+                final_height=final_height, ffmpeg_command=ffmpeg_command, **kwargs)
+
+        return preview
+
+    def count_frames(self, routes, skip_level=5, final_height=500, dwell_f=50, route_frames=None, sample_by="distance"):
         """
+        Counts the frames snake_path_discover would produce for the given routes, without drawing anything
 
+        Parameters
+        ----------
+        routes: routes to plot (list of Route objects)
+        skip_level: frequency of image capture (i.e., every 5 points)
+        final_height: height of final video (does not change the number of frames)
+        dwell_f: number of frames to dwell on final map image (default 50)
+        route_frames: number of frames per route (see snake_path_discover)
+        sample_by: how frames are spread along a route (see snake_path_discover)
+
+        Returns
+        ----------
+        Number of frames (int)
+        """
+
+        return self.plan_snake_path(routes, skip_level=skip_level, dwell_f=dwell_f, route_frames=route_frames, sample_by=sample_by).n_frames
+
+    def plan_snake_path(self, routes, skip_level=5, dwell_f=50, route_frames=None, sample_by="distance"):
+        """
+        Plans the frames of snake_path_discover without drawing anything (see plan.FramePlan)
+
+        Parameters
+        ----------
+        routes: routes to plot (list of Route objects)
+        skip_level: frequency of image capture (i.e., every 5 points), not used if route_frames is given
+        dwell_f: number of frames to dwell on final map image (default 50)
+        route_frames: if not None, number of frames in which each route is discovered (int, or list with one int per
+          route), the frames are spread evenly along the route instead of every skip_level points (picture zooms and
+          the final dwell come on top)
+        sample_by: how frames are spread along a route when route_frames is given, 'distance' or 'time' (see
+          Route.sample_points, default 'distance')
+
+        Returns
+        ----------
+        FramePlan object
+        """
+
+        entries = []
+
+        def add(kind, box, frames=1, route=-1, stop=0, end=False, index=-1, distance=0.0, pic=-1, pic_height=0):
+            entries.append((kind, frames, route, stop, end, index, distance, pic, pic_height,
+                [box.top_left.x, box.top_left.y, box.bot_right.x, box.bot_right.y]))
+
+        # the zoom and pan boxes are tracked in self.sub_box
+        sub_box = self.sub_box
+        self.sub_box = self.box
         current_box = self.box
 
-        for route in routes:
+        if (route_frames is not None) and (not isinstance(route_frames, (list, tuple))):
+            route_frames = [route_frames for i in routes]
+
+        for r, route in enumerate(routes):
+            # points that get a frame
+            if route_frames is None:
+                frame_points = range(0, len(route), skip_level)
+            else:
+                frame_points = route.sample_points(route_frames[r], by=sample_by).tolist()
+
             # determine zoom box
             zoom_box_height = route.d_y
             if route.d_x > route.d_y:
                 zoom_box_height = int(route.d_x/self.asp_ratio)
-            elif route.d_x <= route.d_y:
-                zoom_box_width = int(route.d_y*self.asp_ratio)
-
-            # list for tracking elevation indices
-            elev_indices = []
 
             zoom_box = Box(Point(*route.center, elev=None), zoom_box_height, self.asp_ratio).crop_to_limits([self.shape[1], self.shape[0]])
 
             # zoom in
-            self.vid_frames += self.zoom_and_pan(current_box, zoom_box, 100, final_height)
+            for box in self._zoom_and_pan_boxes(current_box, zoom_box, 100):
+                add(PAN, box)
             current_box = zoom_box
+            box = self.sub_box
 
-            # tracking distance
-            tot_distance = 0
+            # pictures play in the order of their nearest point, before the first frame after that point
+            n_pic = 0
 
-            # elevation tracker bar dimensions
-            elev_bar_x_offset = 10
-            elev_bar_height = int(0.333*final_height)
-            elev_bar_asp_ratio = 0.1
-            elev_bar_width = int(elev_bar_asp_ratio*elev_bar_height)
-            elev_bar_top_left = (elev_bar_x_offset, int(final_height*0.333))
-            elev_bar_bot_right = (elev_bar_x_offset+elev_bar_width, int(final_height*0.333)+elev_bar_height)
+            # run snake
+            for a in frame_points:
+                if (n_pic < len(route.pics)) and (a > route.pics[n_pic].nearest_index):
+                    heights = self.pic_zoom_heights(route.pics[n_pic], 10, step=50, h_f=1000)
+                    if heights:
+                        pic = {"route": r, "stop": a+1, "pic": n_pic}
+                        for h in heights:
+                            add(PICTURE, box, pic_height=h, **pic)
+                        # same dwell as add_pic_zoom
+                        add(PICTURE, box, frames=50, pic_height=heights[-1], **pic)
+                        for h in heights[::-1]:
+                            add(PICTURE, box, pic_height=h, **pic)
+                    n_pic += 1
 
-            # dimensions of live elevation
-            elev_track_width = elev_bar_width
-            elev_track_height = int(0.15*elev_bar_width)
+                add(POINT, box, route=r, stop=a+1, index=a, distance=route.cum_distance[a])
 
-            # pictures that go with the route
-            route_pics = copy.copy(route.pics)
+            # the last frame of the route is held for the dwell (and clears the last marker)
+            a = len(route) - 1
+            add(POINT, box, frames=1+dwell_f, route=r, stop=len(route), end=True, index=a, distance=route.cum_distance[a])
 
-            # run snake
-            for a,i in enumerate(route.all_indices):
-                add_pic = False
-                skip = False
-
-                if a > 0:
-                    tot_distance += calculate_distance_index(i["center"], route.all_indices[a-1]["center"]) * self.dist_per_pixel_avg
-                for j in i["addl_points"]:
-                    if not self.add_pixel(*j, [0,0,0], add=False):
-                        skip = True
-                        continue
-                    self.image[j[1]][j[0]] = discover_map[j[1]][j[0]]
-                for k in i["center_points"]:
-                    if not self.add_pixel(*k, [0,0,0], add=False):
-                        skip = True
-                        continue
-                    self.image[k[1]][k[0]] = marker_col
-
-                # clear marker from previous frame
-                if clear_marker and (not skip):
-                    if a > 0:
-                        for p in route.all_indices[a-1]["center_points"]:
-                            self.image[p[1]][p[0]] = discover_map[p[1]][p[0]]
-
-                if len(route_pics) > 0:
-                    if a > route_pics[0].nearest_index:
-                        add_pic = True
-
-                # save the image
-                if a%skip_level == 0:
-                    save_img = cv2.resize(copy.deepcopy(self.sub_box.extract_box(self.image)), [int(final_height*self.asp_ratio), final_height], interpolation=cv2.INTER_AREA)
-                    if distance:
-                        self.draw_distance_text(save_img, tot_distance, **distance)
-                    if elev:
-                        if elev["type"] == "bar":
-                            self.draw_elev_bar(save_img, a, route, **elev["kws"])
-                        elif elev["type"] == "prof":
-                            self.draw_elev_profile(save_img, a, elev_indices, route, **elev["kws"])
-                    if add_pic:
-                        f = route_pics.pop(0)
-                        self.add_pic_zoom(f, copy.deepcopy(self.image), 10, final_height, step=50, h_f=1000)
-                        add_pic = False
-
-                    self.vid_frames.append(save_img)
-
-            if clear_marker:
-                for i in route.all_indices[a]["center_points"]:
-                    if not self.add_pixel(*i, [0,0,0], add=False):
-                        continue
-                    self.image[i[1]][i[0]] = discover_map[i[1]][i[0]]
-
-            save_img = cv2.resize(copy.deepcopy(self.sub_box.extract_box(self.image)), [int(final_height*self.asp_ratio), final_height], interpolation=cv2.INTER_AREA)
-            if distance:
-                self.draw_distance_text(save_img, tot_distance, **distance)
-            if elev:
-                if elev["type"] == "bar":
-                    self.draw_elev_bar(save_img, a, route, **elev["kws"])
-                elif elev["type"] == "prof":
-                        self.draw_elev_profile(save_img, a, elev_indices, route, **elev["kws"])
-
-            self.vid_frames.append(save_img)
-            self.vid_frames += [self.vid_frames[-1]] * dwell_f
-
-        self.vid_frames += self.zoom_and_pan(current_box, self.box, 100, final_height)
-        write_video(self.vid_frames, save_path, fps=fps)
+        # zoom out
+        for box in self._zoom_and_pan_boxes(current_box, self.box, 100):
+            add(PAN, box)
+
+        self.sub_box = sub_box
+
+        meta = {"skip_level": skip_level, "dwell_f": dwell_f, "route_frames": route_frames, "sample_by": sample_by, "shape": list(self.shape[:2]),
+                "route_lengths": [len(i) for i in routes], "route_pics": [len(i.pics) for i in routes]}
+
+        return FramePlan(entries, meta)
+
+    def _execute_plan(self, plan, routes, discover_map, marker_col, final_height, clear_marker, distance, elev):
+        """
+        Produces the frames of a frame plan (see snake_path_discover for parameter descriptions)
+        """
+
+        plan.check_routes(routes)
+        entries = plan.entries
+        size = [int(final_height*self.asp_ratio), final_height]
+
+        # lists for tracking elevation indices
+        elev_indices = [[] for i in routes]
+
+        n = 0
+        while n < len(entries):
+            if self.frames_done():
+                return
+
+            # consecutive pans and frames of the same picture zoom are added together
+            kind = entries["kind"][n]
+            m = n + 1
+            if kind != POINT:
+                while (m < len(entries)) and (entries["kind"][m] == kind) and (entries["pic"][m] == entries["pic"][n]) and (entries["route"][m] == entries["route"][n]):
+                    m += 1
+
+            run = entries[n:m]
+            n = m
+
+            if kind == PAN:
+                # the map does not change while panning, so the views don't need to be copied...
+                for i in run:
+                    self.sub_box = Box.from_corners(*i["box"])
+                    self.add_view(self.sub_box, final_height, snapshot=False)
+
+                # ...as long as they have been resized before the map is drawn on again
+                self.flush_frames()
+                continue
+
+            e = run[0]
+            route = routes[e["route"]]
+            self.sub_box = Box.from_corners(*e["box"])
+
+            # points are drawn in batches, right before the next frame that is rendered (see sync_map)
+            self.queue_points(route, int(e["stop"]), discover_map, marker_col, clear_marker, end_of_route=bool(e["end"]))
+
+            if kind == PICTURE:
+                n_frames = int(run["frames"].sum())
+                if not self.frames_in_range(n_frames):
+                    self.skip_frames(n_frames)
+                    continue
+
+                # each height is only drawn once (the zoom plays forward and in reverse)
+                self.sync_map()
+                heights = list(dict.fromkeys(int(i) for i in run["pic_height"]))
+                frames = dict(zip(heights, self.pic_frames(route.pics[e["pic"]], self.image, heights, final_height)))
+
+                for i in run:
+                    if i["frames"] == 1:
+                        self.add_frames([frames[int(i["pic_height"])]])
+                    else:
+                        self.add_held(frames[int(i["pic_height"])], int(i["frames"]))
+                continue
+
+            # overlays are drawn in frame order, after the frame has been resized
+            finish = functools.partial(self.draw_overlays, index=int(e["index"]), route=route, tot_distance=float(e["distance"]),
+                    elev_indices=elev_indices[e["route"]], distance=distance, elev=elev)
+
+            if e["frames"] == 1:
+                self.add_view(self.sub_box, final_height, finish=finish)
+            elif self.frames_in_range(int(e["frames"])):
+                # held frames are rendered right away (after the overlays of earlier frames)
+                self.flush_frames()
+                self.sync_map()
+                save_img = cv2.resize(self.map_view(self.sub_box, final_height), size, interpolation=cv2.INTER_AREA)
+                finish(save_img)
+
+                self.add_held(save_img, int(e["frames"]))
+            else:
+                self.skip_frames(int(e["frames"]))
 
 
 
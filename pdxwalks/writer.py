@@ -0,0 +1,475 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import shlex
+import shutil
+import subprocess
+import threading
+
+import cv2
+import numpy as np
+
+# encoder settings used when no ffmpeg command is given (same as the default GUI config)
+DEFAULT_FFMPEG_COMMAND = "ffmpeg -i <file> -vcodec libx264 -pix_fmt yuv420p -crf 30 <out_file>"
+
+# fastest x264 settings, for previews
+PREVIEW_FFMPEG_COMMAND = "ffmpeg -i <file> -vcodec libx264 -preset ultrafast -tune zerolatency -pix_fmt yuv420p -crf 35 <out_file>"
+
+def open_writer(path, fps=15, ffmpeg_command=None):
+    """
+    Opens the best available frame writer. Frames are piped straight into ffmpeg if a command is given and ffmpeg is
+      installed, otherwise they are encoded by OpenCV
+
+    Parameters
+    ----------
+    path: path to which you want to save the video
+    fps: frame rate of the video (default 15)
+    ffmpeg_command: ffmpeg command template with <file> and <out_file> placeholders (see FFmpegWriter), None to
+      always use OpenCV
+
+    Returns
+    ----------
+    FFmpegWriter or FrameWriter
+    """
+
+    if ffmpeg_command:
+        if shutil.which(shlex.split(ffmpeg_command)[0]):
+            return FFmpegWriter(path, fps=fps, ffmpeg_command=ffmpeg_command)
+        print("ffmpeg not found, falling back to OpenCV's mp4v encoder")
+
+    return FrameWriter(path, fps=fps)
+
+class FrameWriter:
+    # frames are written as soon as they are submitted
+    asynchronous = False
+
+    # the last frame is kept for hold, every earlier frame can be reused by the caller
+    max_pending = 1
+
+    def __init__(self, path, fps=15):
+        """
+        Streams frames to a video file as they are produced, so that frames never need to be held in memory
+
+        Parameters
+        ----------
+        path: path to which you want to save the video
+        fps: frame rate of the video (default 15)
+        """
+
+        self.path = path
+        self.fps = fps
+
+        # opened lazily, the frame size is not known until the first frame arrives
+        self.writer = None
+        self.n_frames = 0
+        self.last_frame = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def _open(self, frame):
+        height, width = frame.shape[:2]
+        fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
+        self.writer = cv2.VideoWriter(self.path, fourcc, self.fps, (width, height))
+
+    def write(self, frame):
+        """
+        Writes a single frame to the video
+
+        Parameters
+        ----------
+        frame: image matrix
+        """
+
+        if self.writer is None:
+            self._open(frame)
+
+        self.writer.write(frame)
+        self.n_frames += 1
+        self.last_frame = frame
+
+    def hold(self, n):
+        """
+        Holds the last written frame for n more frames, by handing the same buffer to the encoder again
+
+        Parameters
+        ----------
+        n: number of frames
+        """
+
+        for i in range(n):
+            self.write(self.last_frame)
+
+    def write_all(self, frames):
+        """
+        Writes an iterable of frames to the video
+
+        Parameters
+        ----------
+        frames: iterable of image matrices (can be a generator)
+        """
+
+        for i in frames:
+            self.write(i)
+
+    def submit(self, fn, *args, finish=None, **kwargs):
+        """
+        Produces a frame by calling fn(*args, **kwargs) and writes it (same interface as FramePipeline.submit)
+
+        Parameters
+        ----------
+        fn: function that returns an image matrix
+        finish: optional function called with the frame before it is written (e.g. to draw overlays)
+        """
+
+        frame = fn(*args, **kwargs)
+        if finish is not None:
+            finish(frame)
+        self.write(frame)
+
+    def flush(self):
+        """
+        Nothing to wait for, frames are written synchronously (same interface as FramePipeline.flush)
+        """
+
+        return
+
+    def release(self):
+        """
+        Finalizes the video file
+        """
+
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+class FFmpegWriter(FrameWriter):
+    def __init__(self, path, fps=15, ffmpeg_command=DEFAULT_FFMPEG_COMMAND):
+        """
+        Streams raw BGR frames into an ffmpeg subprocess, so the video is encoded once with ffmpeg's codecs instead of
+          being written with OpenCV first and re-encoded afterwards
+
+        Parameters
+        ----------
+        path: path to which you want to save the video
+        fps: frame rate of the video (default 15)
+        ffmpeg_command: ffmpeg command template, e.g. 'ffmpeg -i <file> -vcodec libx264 -pix_fmt yuv420p -crf 30 <out_file>'.
+          The input and output are replaced by the frame pipe and path, every other argument is kept as an output option
+        """
+
+        super().__init__(path, fps=fps)
+
+        args = shlex.split(ffmpeg_command)
+        self.ffmpeg_bin = args[0]
+        self.output_args = []
+
+        n = 1
+        while n < len(args):
+            if (args[n] == "-i") and (n+1 < len(args)) and (args[n+1] == "<file>"):
+                n += 2
+                continue
+            if args[n] != "<out_file>":
+                self.output_args.append(args[n])
+            n += 1
+
+        self.process = None
+        self.last_buffer = None
+
+    def _open(self, frame):
+        height, width = frame.shape[:2]
+
+        output_args = list(self.output_args)
+
+        # yuv420p needs even dimensions, pad odd ones with a single pixel
+        if ((width % 2) or (height % 2)) and ("-vf" not in output_args):
+            output_args = ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"] + output_args
+
+        command = [self.ffmpeg_bin, "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-"]
+        command += output_args + [self.path]
+
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        """
+        Writes a single frame to the video
+
+        Parameters
+        ----------
+        frame: image matrix
+        """
+
+        if self.process is None:
+            self._open(frame)
+
+        self.last_buffer = np.ascontiguousarray(frame).data
+        self._write_buffer(self.last_buffer)
+
+    def hold(self, n):
+        """
+        Holds the last written frame for n more frames, the raw frame is piped again as is (x264 encodes the repeats
+          as skipped blocks, so they cost next to nothing)
+
+        Parameters
+        ----------
+        n: number of frames
+        """
+
+        for i in range(n):
+            self._write_buffer(self.last_buffer)
+
+    def _write_buffer(self, buffer):
+        try:
+            self.process.stdin.write(buffer)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg stopped accepting frames while writing {self.path}")
+
+        self.n_frames += 1
+
+    def release(self):
+        """
+        Finalizes the video file
+        """
+
+        if self.process is not None:
+            self.process.stdin.close()
+            code = self.process.wait()
+            self.process = None
+            if code != 0:
+                raise RuntimeError(f"ffmpeg exited with code {code} while writing {self.path}")
+
+class SegmentWriter(FrameWriter):
+    def __init__(self, open_segment, segment_frames, on_segment=None, first_segment=0):
+        """
+        Splits a video into segment files with a fixed number of frames. Each segment is finalized as soon as it is
+          full, so everything up to the last finished segment survives if the render is interrupted
+
+        Parameters
+        ----------
+        open_segment: function that returns the writer of segment n (FrameWriter)
+        segment_frames: number of frames per segment
+        on_segment: optional function called with (n, writer) once segment n has been finalized
+        first_segment: number of the first segment (default 0)
+        """
+
+        super().__init__(None)
+
+        self.open_segment = open_segment
+        self.segment_frames = segment_frames
+        self.on_segment = on_segment
+        self.segment = first_segment
+
+        # writer of the segment being written, opened with its first frame
+        self.current = None
+
+    def write(self, frame):
+        """
+        Writes a single frame to the current segment
+
+        Parameters
+        ----------
+        frame: image matrix
+        """
+
+        if self.current is None:
+            self.current = self.open_segment(self.segment)
+
+        self.current.write(frame)
+        self.n_frames += 1
+        self.last_frame = frame
+
+        if self.current.n_frames >= self.segment_frames:
+            self._finish_segment()
+
+    def hold(self, n):
+        """
+        Holds the last written frame for n more frames, splitting the hold across segments if needed
+
+        Parameters
+        ----------
+        n: number of frames
+        """
+
+        while n > 0:
+            # a new segment has to start with a full frame
+            if self.current is None:
+                self.write(self.last_frame)
+                n -= 1
+                continue
+
+            k = min(n, self.segment_frames - self.current.n_frames)
+            self.current.hold(k)
+            self.n_frames += k
+            n -= k
+
+            if self.current.n_frames >= self.segment_frames:
+                self._finish_segment()
+
+    def _finish_segment(self):
+        writer = self.current
+        self.current = None
+
+        writer.release()
+        if self.on_segment is not None:
+            self.on_segment(self.segment, writer)
+
+        self.segment += 1
+
+    def release(self):
+        """
+        Finalizes the current (partial) segment
+        """
+
+        if self.current is not None:
+            self._finish_segment()
+
+class FramePipeline:
+    # frames are produced on worker threads after submit returns
+    asynchronous = True
+
+    def __init__(self, writer, workers=4, depth=None):
+        """
+        Bounded-queue render pipeline. Frames are produced on a pool of worker threads and handed to a single
+          writer thread, which applies the finishing step (e.g. overlays) and writes them in submission order.
+          cv2.resize and cv2.VideoWriter.write release the GIL, so resizing and encoding run concurrently with the
+          stamping on the main thread
+
+        Parameters
+        ----------
+        writer: writer that receives the finished frames in order (FrameWriter)
+        workers: number of worker threads producing frames (default 4)
+        depth: maximum number of frames in flight before submit blocks (default 2*workers)
+        """
+
+        self.writer = writer
+        self.workers = workers
+        self.depth = depth or 2*workers
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.queue = queue.Queue(maxsize=self.depth)
+
+        # first exception raised on the writer thread, re-raised on the main thread
+        self.error = None
+
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    @property
+    def n_frames(self):
+        return self.writer.n_frames
+
+    @property
+    def max_pending(self):
+        # frames in the queue, the frame on the writer thread and the last written frame (kept for hold)
+        return self.depth + 2
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+
+                # once something has failed, just drain the queue
+                if self.error is not None:
+                    continue
+
+                kind, value, finish = item
+                if kind == "hold":
+                    self.writer.hold(value)
+                else:
+                    frame = value.result()
+                    if finish is not None:
+                        finish(frame)
+                    self.writer.write(frame)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def submit(self, fn, *args, finish=None, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) on a worker thread, blocks if too many frames are already in flight
+
+        Parameters
+        ----------
+        fn: function that returns an image matrix (must not depend on data that changes after submit returns)
+        finish: optional function called with the frame on the writer thread, in submission order, before it is
+          written (e.g. to draw overlays)
+        """
+
+        self._raise_error()
+        self.queue.put(("frame", self.pool.submit(fn, *args, **kwargs), finish))
+
+    def write(self, frame, finish=None):
+        """
+        Writes an already rendered frame, in order with the submitted frames
+
+        Parameters
+        ----------
+        frame: image matrix
+        finish: optional function called with the frame on the writer thread before it is written (see submit)
+        """
+
+        self._raise_error()
+        future = Future()
+        future.set_result(frame)
+        self.queue.put(("frame", future, finish))
+
+    def write_all(self, frames):
+        """
+        Writes an iterable of already finished frames, in order with the submitted frames
+
+        Parameters
+        ----------
+        frames: iterable of image matrices (can be a generator)
+        """
+
+        for i in frames:
+            self.write(i)
+
+    def hold(self, n):
+        """
+        Holds the last frame (in submission order) for n more frames
+
+        Parameters
+        ----------
+        n: number of frames
+        """
+
+        self._raise_error()
+        self.queue.put(("hold", n, None))
+
+    def flush(self):
+        """
+        Blocks until every submitted frame has been written
+        """
+
+        self.queue.join()
+        self._raise_error()
+
+    def release(self):
+        """
+        Writes the remaining frames, stops the worker threads and finalizes the video file
+        """
+
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.pool.shutdown()
+        self.writer.release()
+        self._raise_error()